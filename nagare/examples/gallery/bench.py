@@ -0,0 +1,263 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Benchmarks of the gallery
+
+Usage: ``python bench.py [-g 10,1000,100000] [-o report.json]``
+
+The thumbnails creation, the rendering of galleries of synthetic photos,
+created into a temporary SQLite database, and the images serving are
+measured. The results are written as a JSON report, to be compared between
+releases.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import optparse
+import tempfile
+import StringIO
+
+try:
+    from PIL import Image, ImageFilter
+    import PIL
+    PIL_VERSION = getattr(PIL, '__version__', getattr(PIL, 'PILLOW_VERSION', None))
+except ImportError:
+    import Image
+    import ImageFilter
+    PIL_VERSION = Image.VERSION
+
+from nagare.examples.util.bench import timeit
+
+import thumb
+
+
+def image(size, mode='RGB'):
+    """Generate a noisy image"""
+    img = Image.effect_noise(size, 64)
+    return img.convert('RGB').convert(mode, palette=Image.ADAPTIVE) if mode == 'P' else img.convert(mode)
+
+
+def encode(img, format):
+    i = StringIO.StringIO()
+    img.save(i, format)
+    return i.getvalue()
+
+
+# ---------------------------------------------------------------------------
+
+def blurDropShadow(image, offset=(5, 5), background=0xffffff, shadow=0x444444, border=8, iterations=3):
+    """The drop shadow pipeline before the masks cache, as a reference"""
+    totalWidth = image.size[0] + abs(offset[0]) + 2 * border
+    totalHeight = image.size[1] + abs(offset[1]) + 2 * border
+    back = Image.new(image.mode, (totalWidth, totalHeight), background)
+
+    shadowLeft = border + max(offset[0], 0)
+    shadowTop = border + max(offset[1], 0)
+    back.paste(shadow, [shadowLeft, shadowTop, shadowLeft + image.size[0], shadowTop + image.size[1]])
+
+    for i in range(iterations):
+        back = back.filter(ImageFilter.BLUR)
+
+    back.paste(image, (border - min(offset[0], 0), border - min(offset[1], 0)))
+    return back
+
+
+def bench_drop_shadow(sizes=((200, 150), (150, 200), (200, 200), (200, 34))):
+    """Compare ``dropShadow(outline(...))`` with and without the masks cache
+
+    Return:
+      - list of (size, reference time, new time) in milliseconds
+    """
+    results = []
+    for size in sizes:
+        img = image(size)
+
+        reference = timeit(lambda: blurDropShadow(thumb.outline(img, border=8, color=0x666666), shadow=0x666666))
+        new = timeit(lambda: thumb.dropShadow(thumb.outline(img, border=8, color=0x666666), shadow=0x666666))
+
+        results.append((size, reference, new))
+
+    return results
+
+
+# Formats used to encode the synthetic images of each mode
+FORMATS = (('RGB', 'JPEG'), ('L', 'JPEG'), ('RGBA', 'PNG'), ('P', 'GIF'))
+
+
+def bench_thumbnail(sizes=((640, 480), (1600, 1200), (4000, 3000))):
+    """Time ``thumb.thumbnail()`` and ``thumb.derivatives()``
+
+    Return:
+      - list of dictionaries
+    """
+    results = []
+    for size in sizes:
+        for (mode, format) in FORMATS:
+            data = encode(image(size, mode), format)
+            number = 3 if size[0] * size[1] > 2000000 else 10
+
+            results.append(dict(
+                size='%dx%d' % size, mode=mode, format=format, bytes=len(data),
+                thumbnail_ms=timeit(lambda: thumb.thumbnail(data), 3, number),
+                derivatives_ms=timeit(lambda: thumb.derivatives(data), 3, number)
+            ))
+
+    return results
+
+
+# ---------------------------------------------------------------------------
+
+def create_database(directory):
+    """Bind the gallery entities to a new SQLite database"""
+    # Imported first: it adapts SQLAlchemy to Elixir
+    from nagare import database  # noqa: F401
+    import elixir
+    from sqlalchemy import create_engine
+    import gallerydata
+
+    gallerydata.__metadata__.bind = create_engine('sqlite:///' + os.path.join(directory, 'gallery.db'))
+    elixir.setup_all()
+    gallerydata.__metadata__.create_all()
+
+
+def create_gallery(name, nb_photos, batch_size=1000):
+    """Insert a gallery of synthetic photos
+
+    All the photos share the same small image, so that the creation of a
+    large gallery stays fast.
+
+    Return:
+      - the ids of the photos
+    """
+    from nagare import database
+    from gallerydata import GalleryData, PhotoData, digest, metadata, thumbnail_metadata
+
+    img = encode(image((320, 240)), 'JPEG')
+    thumbnail = thumb.thumbnail(img)
+
+    with database.session.begin():
+        gallery = GalleryData(name=name)
+    gallery_id = gallery.id
+
+    row = dict(
+        gallery_id=gallery_id, thumbnail_status=u'ready',
+        img=img, img_digest=digest(img),
+        thumbnail=thumbnail, thumbnail_digest=digest(thumbnail),
+        **dict(metadata(img), **thumbnail_metadata(thumbnail))
+    )
+
+    table = PhotoData.table
+    for i in range(0, nb_photos, batch_size):
+        rows = [dict(row, title=u'Photo %d' % n) for n in range(i, min(i + batch_size, nb_photos))]
+        with database.session.begin():
+            database.session.execute(table.insert(), rows)
+
+    return [id for (id,) in database.session.query(PhotoData.id).filter_by(gallery_id=gallery_id)]
+
+
+def bench_gallery(nb_photos):
+    """Time the rendering of a gallery and the sending of its images
+
+    Return:
+      - a dictionary
+    """
+    from webob import Request, exc
+    from nagare import component
+    from nagare.namespaces import xhtml
+
+    import gallery7
+    import imgresponse
+    from gallerydata import count_queries, conversions_savings
+
+    name = u'Gallery %d' % nb_photos
+
+    start = time.time()
+    ids = create_gallery(name, nb_photos)
+    populate = time.time() - start
+
+    gallery = component.Component(gallery7.Gallery(name))
+    number = 1 if nb_photos > 1000 else 10
+
+    with count_queries() as queries:
+        gallery.render(xhtml.Renderer())
+
+    def send(photo, img='img', **headers):
+        request = Request.blank('/', headers=headers)
+        try:
+            getattr(photo, img)(request, None)
+        except exc.HTTPException as response:
+            return ''.join(response(request.environ, lambda status, headers, exc_info=None: None))
+
+    photo = gallery7.Photo(ids[len(ids) // 2])
+    table = gallery7.PhotoData.table
+    etag = imgresponse.blob_digest(table.c.img, table.c.img_digest, photo.id)
+
+    return dict(
+        photos=nb_photos,
+        populate_s=populate,
+        render_ms=timeit(lambda: gallery.render(xhtml.Renderer()), 3, number),
+        render_queries=len(queries),
+        img_ms=timeit(lambda: send(photo)),
+        img_range_ms=timeit(lambda: send(photo, Range='bytes=0-1023')),
+        img_not_modified_ms=timeit(lambda: send(photo, **{'If-None-Match': '"%s"' % etag})),
+        # Read from the database or the blob store each time
+        thumbnail_ms=timeit(lambda: (imgresponse.cache.clear(), send(photo, 'thumbnail'))),
+        # Then from the images cache
+        thumbnail_cached_ms=timeit(lambda: send(photo, 'thumbnail')),
+        # Converted when first asked, then read from the database
+        thumbnail_webp_ms=timeit(lambda: send(photo, 'thumbnail', Accept='image/webp,*/*')),
+        conversions=dict((mime, dict(images=n, source_bytes=source, bytes=size)) for (mime, (n, source, size)) in conversions_savings().items())
+    )
+
+
+# ---------------------------------------------------------------------------
+
+def run(galleries=(10, 1000, 100000)):
+    """Run all the benchmarks
+
+    Return:
+      - the report, as a dictionary
+    """
+    report = dict(
+        python=platform.python_version(),
+        pil=PIL_VERSION,
+        drop_shadow=[
+            dict(size='%dx%d' % size, reference_ms=reference, new_ms=new)
+            for (size, reference, new) in bench_drop_shadow()
+        ],
+        thumbnail=bench_thumbnail(),
+        galleries=[]
+    )
+
+    directory = tempfile.mkdtemp(prefix='gallery_bench')
+    try:
+        create_database(directory)
+        for nb_photos in galleries:
+            report['galleries'].append(bench_gallery(nb_photos))
+    finally:
+        shutil.rmtree(directory)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [-g 10,1000,100000] [-o report.json]')
+    parser.add_option('-g', '--galleries', default='10,1000,100000', help='numbers of photos of the synthetic galleries')
+    parser.add_option('-o', '--output', help='file of the JSON report (default: standard output)')
+    (options, args) = parser.parse_args()
+
+    report = run([int(n) for n in options.galleries.split(',')])
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
@@ -0,0 +1,181 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Content addressed storage of the images, out of the database
+
+The images are files named by their SHA-256 digest, in a directory tree
+sharded by the first characters of the digest. Identical images are stored
+only once.
+
+When a store is used, the BLOB columns of the new photos stay ``NULL`` and
+their digest columns are the keys into the store. The store is set by thread,
+so that only the application configured with it uses it.
+"""
+
+import os
+import mmap
+import hashlib
+import threading
+import StringIO
+
+from nagare.examples.util.files import create_file
+
+
+class FileStore(object):
+    def __init__(self, root, depth=2):
+        """Initialization
+
+        In:
+          - ``root`` -- directory of the store
+          - ``depth`` -- number of levels of 2 characters sub-directories
+        """
+        self.root = os.path.abspath(root)
+        self.depth = depth
+
+    def path(self, digest):
+        """Location of an image"""
+        return os.path.join(self.root, *[digest[i * 2:i * 2 + 2] for i in range(self.depth)] + [digest])
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def put(self, data):
+        """Store an image
+
+        In:
+          - ``data`` -- the image data
+
+        Return:
+          - the digest of the image
+        """
+        return self.put_file(StringIO.StringIO(data), hashlib.sha256(data).hexdigest())
+
+    def put_file(self, f, digest, chunk_size=64 * 1024):
+        """Store an image from a file
+
+        In:
+          - ``f`` -- file object of the image data
+          - ``digest`` -- the already computed digest of the image data
+          - ``chunk_size`` -- size of the chunks copied
+
+        Return:
+          - the digest of the image
+        """
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            create_file(path, iter(lambda: f.read(chunk_size), ''))
+
+        return digest
+
+    def open(self, digest):
+        """Map an image into memory
+
+        Return:
+          - a read-only ``mmap`` object
+        """
+        with open(self.path(digest), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                # An empty file can't be mapped
+                return ''
+
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, digest):
+        """Read an image
+
+        Return:
+          - the image data
+        """
+        data = self.open(digest)
+        return data[:]
+
+
+# The store of the application served by the current thread
+_current = threading.local()
+
+
+def use(store):
+    """Set the blob store of the current thread
+
+    In:
+      - ``store`` -- a ``FileStore``. The images are stored into the database
+        if ``None``
+    """
+    _current.store = store
+
+
+def current():
+    """The blob store of the current thread, ``None`` if none"""
+    return getattr(_current, 'store', None)
+
+
+def configure(root):
+    """Set the blob store of the current thread, from its directory
+
+    In:
+      - ``root`` -- directory of the store. The images are stored into the
+        database if empty
+    """
+    use(FileStore(root) if root else None)
+
+
+def put(data):
+    """Keep an image data
+
+    Return:
+      - a tuple (value of the BLOB column, digest)
+    """
+    if data is None:
+        return None, None
+
+    store = current()
+    if store is None:
+        return data, hashlib.sha256(data).hexdigest()
+
+    return None, store.put(data)
+
+
+def put_upload(upload):
+    """Keep an uploaded image
+
+    In:
+      - ``upload`` -- an ``upload.Upload`` object
+
+    Return:
+      - a tuple (value of the BLOB column, digest)
+    """
+    store = current()
+    if store is None:
+        return upload.read(), upload.digest
+
+    f = upload.open()
+    try:
+        return None, store.put_file(f, upload.digest)
+    finally:
+        f.close()
+
+
+def get(data, digest):
+    """Read an image data
+
+    In:
+      - ``data`` -- value of the BLOB column
+      - ``digest`` -- value of the digest column
+
+    Return:
+      - the image data, from the database or the store
+    """
+    if data is not None:
+        return str(data)
+
+    store = current()
+    return None if (store is None) or (digest is None) else store.get(digest)
@@ -24,6 +24,10 @@ class Photo(object):
     def title(self):
         return PhotoData.get(self.id).title
 
+    @property
+    def img_size(self):
+        return PhotoData.get(self.id).img_size
+
     def img(self):
         return str(PhotoData.get(self.id).img)
 
@@ -45,7 +49,7 @@ def render(self, h, comp, *args):
         h << h.img.action(self.thumbnail)
         h << h.br
         h << h.a(self.title).action(comp.answer, self)
-        h << h.i(' (%d octets)' % len(self.img()))
+        h << h.i(' (%d octets)' % self.img_size)
 
     return h.root
 
@@ -8,42 +8,288 @@
 # --
 
 """Adding significative URLs"""
-from nagare import presentation, component, editor, validator, continuation
+import re
+import hashlib
 
-from gallerydata import PhotoData, GalleryData
+from sqlalchemy import select
+from webob import exc, Request
+
+from nagare import presentation, component, editor, validator, continuation, wsgi, database
+
+from gallerydata import PhotoData, RenditionData, GalleryData, photo_summaries, gallery_summaries, slug_summary, conversion
+import imgresponse
+import thumbpool
 import thumb
+import blobstore
+import upload
 
 
 # ---------------------------------------------------------------------------
 
+# Stable URL of an image, relative to the application: the photo id, the
+# digest of the image and ``img``, ``thumbnail`` or the size of a rendition
+IMG_URL = re.compile(r'^/img/(\d+)/([0-9a-f]{64})/(img|thumbnail|\d+)$')
+
+# The images never change for a given URL
+IMG_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def img_url(h, id, digest, rendition):
+    """Stable URL of an image
+
+    In:
+      - ``h`` -- the renderer
+      - ``id`` -- id of the photo
+      - ``digest`` -- digest of the image
+      - ``rendition`` -- ``img``, ``thumbnail`` or the size of a rendition
+
+    Return:
+      - the URL or ``None`` if the application is not a ``WSGIApp``, or
+        if the renderer has no request, which then serves the images by
+        actions
+    """
+    prefix = None if h.request is None else h.request.environ.get('gallery.img_url')
+    if (prefix is None) or (digest is None):
+        return None
+
+    return '%s/%d/%s/%s' % (prefix, id, digest, rendition)
+
+
+def accepts(request, mime):
+    """Is a MIME type explicitly accepted by the browser?
+
+    The ``*/*`` and ``image/*`` wildcards are ignored, so the images are only
+    converted for the browsers announcing the format.
+    """
+    for accept in request.headers.get('Accept', '').split(','):
+        params = [param.strip() for param in accept.split(';')]
+        if params[0] == mime:
+            q = [param[2:] for param in params[1:] if param.startswith('q=')]
+            try:
+                return (float(q[0]) > 0) if q else True
+            except ValueError:
+                return False
+
+    return False
+
+
+def serve_negotiated(request, photo_id, size, mime, column, digest_column, id):
+    """Send a thumbnail or a rendition, in the best format accepted by the browser
+
+    The converted images are created when first asked, then kept as
+    ``RenditionData`` rows.
+
+    In:
+      - ``request`` -- the web request
+      - ``photo_id`` -- id of the photo
+      - ``size`` -- size of the rendition, ``0`` for the thumbnail
+      - ``mime`` -- MIME type of the image
+      - ``column``, ``digest_column``, ``id`` -- the image, see ``imgresponse.serve()``
+    """
+    for format in thumb.conversions():
+        if (format != mime) and accepts(request, format):
+            def source():
+                row = database.session.execute(select([column, digest_column], column.table.c.id == id)).first()
+                return blobstore.get(*row)
+
+            try:
+                id = conversion(photo_id, size, format, source)
+            except (IOError, ValueError):
+                # Not convertible, the image is sent in its format
+                break
+
+            table = RenditionData.table
+            (column, digest_column, mime) = (table.c.data, table.c.digest, format)
+            break
+
+    # The shared caches must keep an image by format
+    imgresponse.serve(request, column, digest_column, id, mime, vary='Accept', cached=True)
+
+
+def serve_img(request, id, digest, rendition):
+    """Send an image from its stable URL
+
+    In:
+      - ``request`` -- the web request
+      - ``id`` -- id of the photo
+      - ``digest`` -- digest of the image
+      - ``rendition`` -- ``img``, ``thumbnail`` or the size of a rendition
+    """
+    photos = PhotoData.table
+
+    if rendition in ('img', 'thumbnail'):
+        (column, digest_column, size) = (photos.c[rendition], photos.c[rendition + '_digest'], 0)
+        query = select([photos.c.id, photos.c.mime], (photos.c.id == id) & (digest_column == digest))
+    else:
+        table = RenditionData.table
+        (column, digest_column, size) = (table.c.data, table.c.digest, int(rendition))
+        query = select(
+            [table.c.id, photos.c.mime],
+            (table.c.photo_id == photos.c.id) & (photos.c.id == id) &
+            (table.c.size == size) & (table.c.format == None) & (digest_column == digest)  # noqa: E711
+        )
+
+    row = database.session.execute(query).first()
+    if row is None:
+        # No such image, or it changed since the URL was created
+        raise exc.HTTPNotFound()
+
+    if rendition == 'img':
+        # The original image is always sent unchanged
+        imgresponse.serve(request, column, digest_column, row[0], row[1])
+    else:
+        serve_negotiated(request, id, size, row[1], column, digest_column, row[0])
+
+
+class Rendition(object):
+    """Image action sending a rendition of a photo"""
+    def __init__(self, photo_id, size, id, mime):
+        self.photo_id = photo_id
+        self.size = size
+        self.id = id
+        self.mime = mime
+
+    def __call__(self, request, response):
+        table = RenditionData.table
+        serve_negotiated(request, self.photo_id, self.size, self.mime, table.c.data, table.c.digest, self.id)
+
+
+class Sprite(object):
+    """Image action sending the sprite sheet of the thumbnails of a page"""
+    def __init__(self, ids, digests):
+        """Initialization
+
+        In:
+          - ``ids`` -- ids of the photos
+          - ``digests`` -- digests of their thumbnails, the key of the sheet
+        """
+        self.ids = ids
+        self.digests = tuple(digests)
+
+    def sheet(self):
+        """Return the ``thumb.sprite()`` sheet, only reading the thumbnails
+        if it is not in the cache
+        """
+        def thumbnails():
+            table = PhotoData.table
+            query = select([table.c.id, table.c.thumbnail, table.c.thumbnail_digest], table.c.id.in_(self.ids))
+            rows = dict((row.id, row) for row in database.session.execute(query))
+
+            for id in self.ids:
+                yield blobstore.get(rows[id].thumbnail, rows[id].thumbnail_digest)
+
+        return thumb.sprite(self.digests, thumbnails())
+
+    def __call__(self, request, response):
+        etag = hashlib.sha256(' '.join(self.digests)).hexdigest()
+        if etag in request.if_none_match:
+            raise exc.HTTPNotModified(etag=etag)
+
+        (data, mime, boxes) = self.sheet()
+        raise imgresponse.BlobResponse(body=data, content_type=mime, etag=etag, conditional_response=True)
+
+
 class Photo(object):
-    def __init__(self, id):
+    def __init__(self, id, summary=None):
+        """Initialization
+
+        In:
+          - ``id`` -- id of the photo
+          - ``summary`` -- the metadata of the photo, as returned by
+            ``photo_summaries()``. Read from the database if not given
+        """
         self.id = id
+        self.summary = summary or photo_summaries(PhotoData.table.c.id == id)[0]
+        # In sprite mode, the URL of the sheet and the box of the thumbnail into it
+        self.sprite = None
 
     @property
     def title(self):
-        return PhotoData.get(self.id).title
+        return self.summary['title']
 
-    def img(self):
-        return str(PhotoData.get(self.id).img)
+    @property
+    def thumbnail_status(self):
+        return self.summary['thumbnail_status']
 
-    def thumbnail(self):
-        return str(PhotoData.get(self.id).thumbnail)
+    @property
+    def img_size(self):
+        return self.summary['img_size']
+
+    @property
+    def renditions(self):
+        """The ids, sizes, widths and digests of the renditions of the photo"""
+        table = RenditionData.table
+        query = select(
+            [table.c.id, table.c.size, table.c.width, table.c.digest],
+            (table.c.photo_id == self.id) & (table.c.format == None)  # noqa: E711
+        ).order_by(table.c.width)
+
+        return database.session.execute(query).fetchall()
+
+    # The images are streamed from the database or the blob store, with HTTP
+    # caching and ranges support
+    def img(self, request, response):
+        table = PhotoData.table
+        imgresponse.serve(request, table.c.img, table.c.img_digest, self.id, self.summary['mime'])
+
+    def thumbnail(self, request, response):
+        table = PhotoData.table
+        serve_negotiated(request, self.id, 0, self.summary['mime'], table.c.thumbnail, table.c.thumbnail_digest, self.id)
 
 
 @presentation.render_for(Photo)
 def render(self, h, comp, *args):
-    img = h.img.action(self.img)
+    (mime, width) = (self.summary['mime'], self.summary['width'])
+
+    src = img_url(h, self.id, self.summary['img_digest'], 'img')
+    img = h.img(src=src) if src else h.img.action(self.img, with_request=True)
+
+    # The browser chooses the smallest adequate rendition
+    srcset = [
+        (img_url(h, self.id, digest, size) or h.img.action(Rendition(self.id, size, id, mime), with_request=True).get('src'), w)
+        for (id, size, w, digest) in self.renditions
+    ]
+    if srcset and width:
+        srcset.append((img.get('src'), width))
+        img.set('srcset', ', '.join('%s %dw' % src for src in srcset))
+        img.set('sizes', '(max-width: %dpx) 100vw, %dpx' % (width, width))
+        img.set('style', 'max-width: 100%')
+
     return h.a(img).action(comp.answer)
 
 
 @presentation.render_for(Photo, model='thumbnail')
 def render(self, h, comp, *args):
     with h.div:
-        h << h.img.action(self.thumbnail)
+        status = self.thumbnail_status
+        if status == 'pending':
+            # The thumbnail is not yet created by the thumbnails pool
+            h << h.div('Thumbnail in progress...', class_='thumbnail_placeholder')
+        elif status == 'failed':
+            h << h.div('No thumbnail', class_='thumbnail_placeholder')
+        elif self.sprite is not None:
+            (url, (x, y, width, height)) = self.sprite
+            h << h.div(
+                class_='sprite', role='img', title=self.title,
+                style='width: %dpx; height: %dpx; background: url(%s) -%dpx -%dpx no-repeat' % (width, height, url, x, y)
+            )
+        else:
+            src = img_url(h, self.id, self.summary['thumbnail_digest'], 'thumbnail')
+            img = h.img(src=src) if src else h.img.action(self.thumbnail, with_request=True)
+
+            preview = self.summary['preview']
+            if preview:
+                # The preview is painted at once, the thumbnail only loaded
+                # when scrolled into view
+                img.set('loading', 'lazy')
+                img.set('width', str(self.summary['thumbnail_width']))
+                img.set('height', str(self.summary['thumbnail_height']))
+                img.set('style', 'background: url(%s) 0 0 / cover' % preview)
+
+            h << img
         h << h.br
         h << h.a(self.title).action(comp.answer, self)
-        h << h.i(' (%d octets)' % len(self.img()))
+        h << h.i(' (%d octets)' % self.img_size)
 
     return h.root
 
@@ -57,14 +303,38 @@ class PhotoCreator(editor.Editor):
         self.img.validate(self.validate_img)
 
     def validate_img(self, img):
+        # The upload of a previous submit of the form is replaced
+        self.discard()
+
         if isinstance(img, basestring):
             raise ValueError('Image not provided')
-        return img.file.read()
+
+        # The upload is spooled, hashed and checked by chunks
+        img = upload.spool(img.file)
+
+        # The JPEG images are decoded at a reduced scale
+        pool = thumbpool.pool
+        (width, height) = thumb.decoded_size((img.width, img.height), img.mime, thumb.largest_size((img.width, img.height), pool.renditions))
+        if width * height > pool.max_pixels:
+            img.discard()
+            raise ValueError('Image too large')
+
+        return img
+
+    def discard(self):
+        """Remove the temporary file of the valid upload, if any"""
+        if self.img.value is not None:
+            self.img.value.discard()
+            self.img.value = None
 
     def commit(self, comp):
         if self.is_validated(('title', 'img')):
             comp.answer((self.title(), self.img.value))
 
+    def cancel(self, comp):
+        self.discard()
+        comp.answer()
+
 
 @presentation.render_for(PhotoCreator)
 def render(self, h, comp, *args):
@@ -81,40 +351,161 @@ def render(self, h, comp, *args):
                 with h.td:
                     h << h.input(type='submit', value='Add', id='submitbutton').action(self.commit, comp)
                     h << ' '
-                    h << h.input(type='submit', value='Cancel', id='submitbutton').action(comp.answer)
+                    h << h.input(type='submit', value='Cancel', id='submitbutton').action(self.cancel, comp)
 
     return h.root
 
 
 # ---------------------------------------------------------------------------
 
-class Gallery(object):
-    def __init__(self, name):
-        self.name = name
+class PhotoPage(object):
+    """A page of the photos of a gallery
+
+    A page starts after the id of the last photo of the previous one (keyset
+    pagination), so it stays the same when photos are added to the gallery
+    """
+    def __init__(self, gallery_name, after=0, size=60, infinite_scroll=False, sprites=False):
+        """Initialization
+
+        In:
+          - ``gallery_name`` -- name of the gallery
+          - ``after`` -- id of the last photo of the previous page
+          - ``size`` -- number of photos of the page
+          - ``infinite_scroll`` -- is the next page appended to this one?
+          - ``sprites`` -- are the thumbnails sent into one sprite sheet?
+        """
+        self.gallery_name = gallery_name
+        self.after = after
+        self.size = size
+        self.infinite_scroll = infinite_scroll
+        self.sprites = sprites
+
         self.photos = []
-        if GalleryData.get_by(name=name) is None:
-            GalleryData(name=name)
+        # Id of the last photo of the page, if a next page exists
+        self.last = None
+        # With the infinite scroll, the next page once loaded
+        self.next = component.Component(None)
 
     def get_photos(self):
-        """Use the database relation to get all the photos of this gallery
+        """Read, in one query, the metadata of the photos of this page
 
         Return:
            ``Photo()`` components
         """
-        photos = GalleryData.get_by(name=self.name).photos
+        # One more photo is read to know if a next page exists
+        photos = gallery_summaries(self.gallery_name, self.after, self.size + 1)
+        self.last = photos[self.size - 1]['id'] if len(photos) > self.size else None
 
-        # Create a Photo object with the id of the photo then make it a component
-        # The url for a photo is its title
-        self.photos = [component.Component(Photo(p.id), url=p.title) for p in photos]
+        # Create a Photo object with the metadata of the photo then make it a component
+        # The url for a photo is its slug
+        self.photos = [component.Component(Photo(p['id'], p), url=p['slug']) for p in photos[:self.size]]
         return self.photos
 
+    def load_next(self):
+        self.next.becomes(PhotoPage(self.gallery_name, self.last, self.size, True, self.sprites))
+
+    def set_sprite(self, h):
+        """Put the ready thumbnails of the page into a sprite sheet"""
+        # No status for the thumbnails created before the thumbnails pool: they are ready
+        photos = [photo() for photo in self.photos if (photo().thumbnail_status in ('ready', None)) and photo().summary['thumbnail_digest']]
+        if photos:
+            sprite = Sprite([photo.id for photo in photos], [photo.summary['thumbnail_digest'] for photo in photos])
+            (data, mime, boxes) = sprite.sheet()
+
+            url = h.img.action(sprite, with_request=True).get('src')
+            for (photo, box) in zip(photos, boxes):
+                photo.sprite = (url, box)
+
+
+@presentation.render_for(PhotoPage)
+def render(self, h, comp, *args):
+    # Always synchronous, even when this page is re-rendered by an asynchronous action
+    s = h.SyncRenderer()
+
+    photos = self.get_photos()
+    if self.sprites:
+        # The sheet is composed now, to know the boxes of the thumbnails
+        self.set_sprite(h)
+
+    with h.div(class_='photo_page'):
+        with h.ul(class_='photo_list'):
+            for photo in photos:
+                photo.on_answer(comp.answer)
+
+                h << h.li(photo.render(s, model='thumbnail'))
+
+        if self.infinite_scroll:
+            if self.next() is not None:
+                self.next.on_answer(comp.answer)
+                h << self.next
+            elif self.last is not None:
+                # Clicked by the ``gallery_scroll`` script when scrolled into view
+                h << h.AsyncRenderer().a('More photos', class_='more_photos').action(self.load_next)
+
+    return h.root
+
+
+class Gallery(object):
+    # Number of photos by page
+    page_size = 60
+    # Are the next pages appended while scrolling, instead of linked?
+    infinite_scroll = False
+    # Are the thumbnails of a page sent into one sprite sheet?
+    sprites = False
+
+    def __init__(self, name, page_size=None, infinite_scroll=None, sprites=None):
+        """Initialization
+
+        In:
+          - ``name`` -- name of the gallery
+          - ``page_size`` -- number of photos by page
+          - ``infinite_scroll`` -- are the next pages appended while scrolling?
+          - ``sprites`` -- are the thumbnails of a page sent into one sprite sheet?
+        """
+        self.name = name
+        if page_size is not None:
+            self.page_size = page_size
+        if infinite_scroll is not None:
+            self.infinite_scroll = infinite_scroll
+        if sprites is not None:
+            self.sprites = sprites
+
+        # Start of the pages before the current one, to go back
+        self.previous = []
+        self.page = component.Component(None)
+        self.goto(0)
+
+        if GalleryData.get_by(name=name) is None:
+            GalleryData(name=name)
+
+    def goto(self, after, previous=()):
+        """Display a page of photos
+
+        In:
+          - ``after`` -- id of the last photo of the previous page
+          - ``previous`` -- start of the pages before this one
+        """
+        self.previous = list(previous)
+
+        # The url of a page is the id where it starts
+        page = PhotoPage(self.name, after, self.page_size, self.infinite_scroll, self.sprites)
+        self.page.becomes(page)
+        # Set directly: ``becomes()`` keeps the url of the previous page when given none
+        self.page.url = ('page/%d' % after) if after else None
+
     def add_photo(self, comp):
         r = comp.call(PhotoCreator())
         if r is not None:
             (title, img) = r
 
-            gallery = GalleryData.get_by(name=self.name)
-            gallery.photos.append(PhotoData(title=title, img=img, thumbnail=thumb.thumbnail(img)))
+            # The slug of the photo is created for its gallery
+            try:
+                photo = PhotoData(title=title, upload=img, gallery=GalleryData.get_by(name=self.name))
+            finally:
+                img.discard()
+
+            # The thumbnail is created in background
+            thumbpool.pool.submit(photo)
 
 
 @presentation.render_for(Gallery)
@@ -131,33 +522,113 @@ def render(self, h, comp, *args):
         padding: 1em;
         margin: 1em;
     }
+
+    .thumbnail_placeholder {
+        width: 200px;
+        height: 150px;
+        line-height: 150px;
+        text-align: center;
+        color: gray;
+        background-color: #eee;
+    }
+
+    .sprite {
+        display: inline-block;
+    }
+
+    .photo_pages, .more_photos {
+        clear: both;
+        display: block;
+        text-align: center;
+    }
+
+    .photo_pages a {
+        margin: 0 1em;
+    }
+
+    .thumbnails_stats {
+        clear: both;
+        font-size: 0.75em;
+    }
     ''')
 
+    if self.infinite_scroll:
+        # Load the next page when its link becomes visible
+        h.head.javascript('gallery_scroll', '''
+        window.addEventListener("load", function () {
+            var observer = new IntersectionObserver(function (entries) {
+                entries.forEach(function (entry) {
+                    if (entry.isIntersecting) {
+                        observer.unobserve(entry.target);
+                        entry.target.click();
+                    }
+                });
+            }, {rootMargin: "200px"});
+
+            function observe() {
+                var links = document.querySelectorAll("a.more_photos:not([data-observed])");
+                for (var i = 0; i < links.length; i++) {
+                    links[i].setAttribute("data-observed", "1");
+                    observer.observe(links[i]);
+                }
+            }
+
+            // The new links are rendered by the asynchronous updates
+            new MutationObserver(observe).observe(document.body, {childList: true, subtree: true});
+            observe();
+        });
+        ''')
+
     with h.div:
         h << h.h1('Gallery: ', self.name)
         h << h.a('Add photo', style='float: right').action(self.add_photo, comp)
         h << h.br
 
-        with h.ul(class_='photo_list'):
-            for photo in self.get_photos():
-                photo.on_answer(comp.call)
+        self.page.on_answer(comp.call)
+        h << self.page
+
+        page = self.page()
+        if not self.infinite_scroll and (page.after or (page.last is not None)):
+            with h.div(class_='photo_pages'):
+                if page.after:
+                    h << h.a('First page').action(self.goto, 0)
+                if self.previous:
+                    h << h.a('Previous page').action(self.goto, self.previous[-1], self.previous[:-1])
+                if page.last is not None:
+                    h << h.a('Next page').action(self.goto, page.last, self.previous + [page.after])
 
-                h << h.li(photo.render(h, model='thumbnail'))
+        h << h.div(component.Component(thumbpool.pool), class_='thumbnails_stats')
+        h << h.div(component.Component(imgresponse.cache), class_='thumbnails_stats')
 
     return h.root
 
 
 # From a URL received, set the components
+@presentation.init_for(Gallery, "(len(url) >= 2) and (url[0] == 'page')")
+def init(self, url, comp, http_method, request):
+    # The URL received is the id where the page starts, then optionally the
+    # slug of a photo
+    try:
+        after = int(url[1])
+    except ValueError:
+        raise presentation.HTTPNotFound()
+
+    self.goto(after)
+
+    if len(url) > 2:
+        comp.init(url[2:], http_method, request)
+
+
 @presentation.init_for(Gallery, "len(url) == 1")
 def init(self, url, comp, *args):
-    # The URL received is the name of the photo
-    photo_data = PhotoData.get_by(title=url[0])
-    if not photo_data:
-        # A photo with this name doesn't exist
+    # The URL received is the slug of the photo, unique into the gallery
+    summary = slug_summary(self.name, url[0])
+    if summary is None:
+        # A photo with this slug doesn't exist
         raise presentation.HTTPNotFound()
 
     # Get the photo data and make a ``Photo`` component
-    photo = component.Component(Photo(photo_data.id))
+    photo = component.Component(Photo(summary['id'], summary))
 
     # Temporary change the Gallery (the ``comp``) with the photo
     continuation.Continuation(comp.call, photo)
@@ -167,3 +638,77 @@ def init(self, url, comp, *args):
 
 def app():
     return Gallery(u'MyGallery2')
+
+
+class WSGIApp(wsgi.WSGIApp):
+    # Blob store of the images, only used by this application
+    blobstore = None
+
+    def __call__(self, environ, start_response):
+        blobstore.use(self.blobstore)
+        try:
+            # The images are served from their stable URLs without any session
+            match = IMG_URL.match(environ.get('PATH_INFO', ''))
+            if match is not None:
+                return self.serve_img(environ, start_response, *match.groups())
+
+            environ['gallery.img_url'] = environ.get('SCRIPT_NAME', '') + '/img'
+            return super(WSGIApp, self).__call__(environ, start_response)
+        finally:
+            # The other applications served by this thread keep their images
+            # into the database
+            blobstore.use(None)
+
+    @staticmethod
+    def serve_img(environ, start_response, id, digest, rendition):
+        try:
+            serve_img(Request(environ), int(id), digest, rendition)
+        except exc.HTTPException as e:
+            response = e
+            if response.status_int in (200, 304):
+                response.cache_control = IMG_CACHE_CONTROL
+        except Exception:
+            database.session.remove()
+            raise
+
+        def app_iter():
+            # The image is read by chunks while sent, then the database session
+            # of the thread is released
+            try:
+                for chunk in response(environ, start_response):
+                    yield chunk
+            finally:
+                database.session.remove()
+
+        return app_iter()
+
+    def set_config(self, config_filename, config, error):
+        super(WSGIApp, self).set_config(config_filename, config, error)
+
+        # Optional ``[gallery]`` section of the application configuration
+        conf = config.get('gallery', {})
+
+        root = conf.get('blobstore')
+        self.blobstore = blobstore.FileStore(root) if root else None
+        imgresponse.cache.configure(int(conf.get('cache_size', imgresponse.cache.max_bytes)))
+
+        Gallery.page_size = int(conf.get('page_size', Gallery.page_size))
+        Gallery.infinite_scroll = str(conf.get('infinite_scroll', Gallery.infinite_scroll)).lower() in ('on', 'true', 'yes', '1')
+        Gallery.sprites = str(conf.get('sprites', Gallery.sprites)).lower() in ('on', 'true', 'yes', '1')
+
+        # Optional ``[thumbnails]`` section of the application configuration
+        conf = config.get('thumbnails', {})
+
+        renditions = conf.get('renditions', thumb.RENDITIONS)
+        if isinstance(renditions, basestring):
+            renditions = [renditions]
+
+        thumbpool.pool.configure(
+            int(conf.get('processes', 0)) or None,
+            int(conf.get('max_pending', 32)),
+            [int(size) for size in renditions],
+            int(conf.get('max_pixels', thumb.MAX_PIXELS))
+        )
+
+
+wsgi_app = WSGIApp(lambda: component.Component(app()))
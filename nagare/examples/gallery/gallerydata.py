@@ -7,18 +7,267 @@
 # this distribution.
 # --
 
-from elixir import Entity, Field, Unicode, BLOB, belongs_to, has_many
-from sqlalchemy import MetaData
+import re
+import hashlib
+import contextlib
+import unicodedata
+
+from elixir import Entity, Field, Unicode, String, Integer, BLOB, belongs_to, has_many, using_table_options
+from elixir.events import after_update, after_delete
+from sqlalchemy import MetaData, UniqueConstraint, select, func, and_, or_, event
+from sqlalchemy.exc import IntegrityError
+
+from nagare import database
+
+import thumb
+import blobstore
+import imgresponse
 
 __metadata__ = MetaData()
 
 
+def digest(data):
+    """Strong digest of an image data, used as its HTTP ETag"""
+    return None if data is None else hashlib.sha256(data).hexdigest()
+
+
+def metadata(data):
+    """Precomputed metadata of an image data
+
+    Return:
+      - a dictionary of the ``img_size``, ``width``, ``height`` and ``mime``
+        columns values
+    """
+    try:
+        (width, height, mime) = thumb.info(data)
+    except IOError:
+        # Not an image format known by PIL
+        width = height = mime = None
+
+    return dict(img_size=len(data), width=width, height=height, mime=mime)
+
+
+def thumbnail_metadata(data):
+    """Precomputed metadata of a thumbnail data
+
+    Return:
+      - a dictionary of the ``thumbnail_width``, ``thumbnail_height`` and
+        ``preview`` columns values
+    """
+    img = thumb.open_image(data)
+    (width, height) = img.size
+
+    return dict(thumbnail_width=width, thumbnail_height=height, preview=thumb.preview(img))
+
+
+def slugify(title):
+    """ASCII, lowercase and dash separated version of a title, for the URLs"""
+    slug = unicodedata.normalize('NFKD', title or u'').encode('ascii', 'ignore')
+    slug = re.sub('[^a-z0-9]+', '-', slug.lower()).strip('-')
+
+    return slug[:80].rstrip('-') or 'photo'
+
+
+def unique_slugs(gallery_id, titles):
+    """Slugs of new photos, unique into their gallery
+
+    In:
+      - ``gallery_id`` -- id of the gallery
+      - ``titles`` -- titles of the new photos
+
+    Return:
+      - list of the slugs, suffixed by ``-2``, ``-3``... when already used
+    """
+    slugs = [slugify(title) for title in titles]
+    if not slugs:
+        return []
+
+    # The gallery row is locked until the end of the transaction, so that the
+    # concurrent transactions adding photos to the gallery wait for the slugs
+    # created by this one
+    galleries = GalleryData.table
+    database.session.execute(galleries.update(galleries.c.id == gallery_id, {galleries.c.name: galleries.c.name}))
+
+    # The slugs already used, read in one query
+    table = PhotoData.table
+    query = select([table.c.slug], (table.c.gallery_id == gallery_id) & or_(*[table.c.slug.like(slug + '%') for slug in set(slugs)]))
+    used = set(slug for (slug,) in database.session.execute(query))
+
+    # And the slugs of the photos of the gallery not yet flushed
+    used.update(
+        photo.slug for photo in database.session.new
+        if isinstance(photo, PhotoData) and (photo.gallery is not None) and (photo.gallery.id == gallery_id)
+    )
+
+    result = []
+    for slug in slugs:
+        (unique, i) = (slug, 2)
+        while unique in used:
+            (unique, i) = ('%s-%d' % (slug, i), i + 1)
+
+        used.add(unique)
+        result.append(unique)
+
+    return result
+
+
 class PhotoData(Entity):
     title = Field(Unicode(100))
-    img = Field(BLOB)
-    thumbnail = Field(BLOB)
+    # Name of the photo into the URLs, unique into its gallery
+    slug = Field(String(100))
+    # The images are only loaded when accessed, so that the listings only
+    # read the metadata
+    img = Field(BLOB, deferred=True)
+    img_digest = Field(String(64))
+    img_size = Field(Integer)
+    width = Field(Integer)
+    height = Field(Integer)
+    mime = Field(String(40))
+    thumbnail = Field(BLOB, deferred=True)
+    thumbnail_digest = Field(String(64))
+    thumbnail_width = Field(Integer)
+    thumbnail_height = Field(Integer)
+    # Tiny image, as a ``data:`` URI, displayed while the thumbnail loads
+    preview = Field(String(2048))
+    # ``pending`` while created by the thumbnails pool, then ``ready`` or
+    # ``failed``
+    thumbnail_status = Field(String(10), default=u'ready')
+    # ``ready`` or ``failed`` once the renditions are created, ``None`` before.
+    # A photo smaller than all the renditions sizes is ready without any
+    renditions_status = Field(String(10))
+
+    # Indexed for the keyset pagination of the galleries
+    belongs_to('gallery', of_kind='GalleryData', column_kwargs={'index': True})
+    has_many('renditions', of_kind='RenditionData', order_by='width')
+
+    # Also the index of the photos lookups by URL
+    using_table_options(UniqueConstraint('gallery_id', 'slug'))
+
+    def __init__(self, upload=None, **kw):
+        """Initialization
+
+        In:
+          - ``upload`` -- an ``upload.Upload`` object, for the ``img`` column
+        """
+        # The photos previously added, and the gallery, are written before the
+        # slug of this one is chosen
+        database.session.flush()
+
+        super(PhotoData, self).__init__(**kw)
+
+        if (self.slug is None) and (self.gallery is not None):
+            self.slug = unique_slugs(self.gallery.id, [self.title])[0]
+
+        if upload is not None:
+            # The metadata were computed while the upload was read
+            self.set(img_size=upload.size, width=upload.width, height=upload.height, mime=upload.mime)
+            (self.img, self.img_digest) = blobstore.put_upload(upload)
+        else:
+            if self.img is not None:
+                self.set(**metadata(self.img))
+
+            # The images are moved to the blob store, if configured
+            (self.img, self.img_digest) = blobstore.put(self.img)
+
+        if self.thumbnail is not None:
+            try:
+                self.set(**thumbnail_metadata(self.thumbnail))
+            except IOError:
+                # Not an image format known by PIL: no dimensions nor preview
+                pass
+
+        (self.thumbnail, self.thumbnail_digest) = blobstore.put(self.thumbnail)
+
+    @after_update
+    @after_delete
+    def invalidate_cache(self):
+        imgresponse.invalidate(PhotoData.table.c.img, self.id)
+        imgresponse.invalidate(PhotoData.table.c.thumbnail, self.id)
+
+
+class RenditionData(Entity):
+    """A resized copy of a photo, or a thumbnail or a rendition converted to
+    another format
+    """
+    # ``0`` for a converted thumbnail
+    size = Field(Integer)
+    width = Field(Integer)
+    height = Field(Integer)
+    data = Field(BLOB, deferred=True)
+    digest = Field(String(64))
+    data_size = Field(Integer)
+    # MIME type of a converted image, ``None`` for the format of the photo
+    format = Field(String(40))
+    # Size of the image a converted image was created from
+    source_size = Field(Integer)
+
+    belongs_to('photo', of_kind='PhotoData', column_kwargs={'index': True})
+
+    # Only one conversion of an image by format
+    using_table_options(UniqueConstraint('photo_id', 'size', 'format'))
+
+    def __init__(self, **kw):
+        super(RenditionData, self).__init__(**kw)
 
-    belongs_to('gallery', of_kind='GalleryData')
+        self.data_size = len(self.data)
+        (self.data, self.digest) = blobstore.put(self.data)
+
+    @after_update
+    @after_delete
+    def invalidate_cache(self):
+        imgresponse.invalidate(RenditionData.table.c.data, self.id)
+
+
+def conversion(photo_id, size, mime, source):
+    """Get a thumbnail or a rendition converted to another format, created if needed
+
+    In:
+      - ``photo_id`` -- id of the photo
+      - ``size`` -- size of the rendition, ``0`` for the thumbnail
+      - ``mime`` -- MIME type of the format
+      - ``source`` -- function returning the image data to convert
+
+    Return:
+      - the id of the ``RenditionData`` row of the converted image
+    """
+    table = RenditionData.table
+
+    where = (table.c.photo_id == photo_id) & (table.c.size == size) & (table.c.format == mime)
+    id = database.session.execute(select([table.c.id], where)).scalar()
+    if id is None:
+        data = source()
+        converted = thumb.convert(data, mime)
+        (width, height) = thumb.open_image(converted).size
+        (blob, digest) = blobstore.put(converted)
+
+        row = dict(
+            photo_id=photo_id, size=size, width=width, height=height,
+            data=blob, digest=digest, data_size=len(converted),
+            format=mime, source_size=len(data)
+        )
+        try:
+            id = database.session.execute(table.insert(), row).inserted_primary_key[0]
+        except IntegrityError:
+            # Created concurrently by another request
+            id = database.session.execute(select([table.c.id], where)).scalar()
+
+    return id
+
+
+def conversions_savings():
+    """Bytes saved by the converted images
+
+    Return:
+      - a dictionary MIME type -> (number of images, bytes of their sources,
+        bytes of the converted images)
+    """
+    table = RenditionData.table
+    query = select(
+        [table.c.format, func.count(table.c.id), func.sum(table.c.source_size), func.sum(table.c.data_size)],
+        table.c.format != None  # noqa: E711
+    ).group_by(table.c.format)
+
+    return dict((row[0], tuple(row[1:])) for row in database.session.execute(query))
 
 
 class GalleryData(Entity):
@@ -27,6 +276,108 @@ class GalleryData(Entity):
     has_many('photos', of_kind='PhotoData')
 
 
+# ---------------------------------------------------------------------------
+
+# Columns of ``PhotoData`` needed to render the photos, without their images
+SUMMARY = (
+    'id', 'title', 'slug', 'img_size', 'img_digest', 'width', 'height', 'mime',
+    'thumbnail_status', 'thumbnail_digest', 'thumbnail_width', 'thumbnail_height', 'preview'
+)
+
+
+def photo_summaries(*criteria, **kw):
+    """Read, in one query, the metadata of photos
+
+    In:
+      - ``criteria`` -- SQL expressions to select the photos
+      - ``limit`` -- maximum number of photos to read (keyword only)
+
+    Return:
+      - list of dictionaries of the ``SUMMARY`` columns values, ordered by ids
+    """
+    table = PhotoData.table
+    query = select([table.c[name] for name in SUMMARY], and_(*criteria)).order_by(table.c.id).limit(kw.get('limit'))
+
+    return [dict(zip(SUMMARY, row)) for row in database.session.execute(query)]
+
+
+def gallery_summaries(name, after=0, limit=None):
+    """Metadata of the photos of a gallery
+
+    The photos are paginated by keyset: a page starts after the id of the
+    last photo of the previous one, so reading any page costs the same.
+
+    In:
+      - ``name`` -- name of the gallery
+      - ``after`` -- only the photos with a greater id are read
+      - ``limit`` -- maximum number of photos to read
+
+    Return:
+      - list of dictionaries of the ``SUMMARY`` columns values, ordered by ids
+    """
+    photos = PhotoData.table
+    galleries = GalleryData.table
+
+    return photo_summaries(
+        photos.c.gallery_id == galleries.c.id, galleries.c.name == name, photos.c.id > after,
+        limit=limit
+    )
+
+
+def slug_summary(name, slug):
+    """Metadata of a photo of a gallery, from its URL
+
+    In:
+      - ``name`` -- name of the gallery
+      - ``slug`` -- slug of the photo
+
+    Return:
+      - dictionary of the ``SUMMARY`` columns values or ``None``
+    """
+    photos = PhotoData.table
+    galleries = GalleryData.table
+
+    summaries = photo_summaries(photos.c.gallery_id == galleries.c.id, galleries.c.name == name, photos.c.slug == slug)
+    return summaries[0] if summaries else None
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Count the SQL queries executed in a ``with`` block
+
+    Return:
+      - a list, filled with the statements executed
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = __metadata__.bind
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextlib.contextmanager
+def assert_queries(expected):
+    """Check the number of SQL queries executed in a ``with`` block
+
+    Example:
+
+      with assert_queries(1):
+          component.Component(gallery7.Gallery(u'MyGallery')).render(xhtml.Renderer())
+    """
+    with count_queries() as statements:
+        yield statements
+
+    assert len(statements) == expected, '%d queries executed, %d expected:\n%s' % (
+        len(statements), expected, '\n'.join(statements)
+    )
+
+
 # ---------------------------------------------------------------------------
 
 def populate1():
@@ -38,7 +389,7 @@ def populate1():
     img = f.read()
     f.close()
 
-    gallery.photos.append(PhotoData(title=u'Dragon', img=img, thumbnail=img))
+    PhotoData(title=u'Dragon', img=img, thumbnail=img, gallery=gallery)
 
 
 def populate2():
@@ -0,0 +1,230 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Streaming of the images stored as BLOBs or in the blob store
+
+An image action registered with ``h.img.action(f, with_request=True)`` can
+raise a ``BlobResponse``: the BLOB is then read by chunks, directly from the
+database or from the memory mapped file of the blob store, while the response
+is sent. The ``Range``, ``If-Range`` and ``If-None-Match`` headers are honored
+and a ``304`` answer only needs the content digest, never the BLOB.
+
+The thumbnails and the renditions are kept in a cache bounded by their total
+size. The original images are always streamed.
+"""
+
+import hashlib
+import imghdr
+
+from sqlalchemy import select, func
+from webob import exc, Response
+
+from nagare import database, presentation
+from nagare.examples.util import lrucache
+
+import blobstore
+
+CHUNK_SIZE = 64 * 1024
+
+# The images recently sent, shared by all the sessions: (table name, column
+# name, id) -> (digest, data)
+cache = lrucache.LRUCache(64 * 1024 * 1024)
+
+
+def invalidate(column, id):
+    """Remove an image from the cache, when changed or deleted"""
+    cache.discard((column.table.name, column.name, id))
+
+
+def read_chunk(column, id, offset, size):
+    """Read a slice of a BLOB
+
+    In:
+      - ``column`` -- the BLOB column
+      - ``id`` -- primary key of the row
+      - ``offset`` -- position of the first byte to read
+      - ``size`` -- number of bytes to read
+
+    Return:
+      - the bytes read
+    """
+    query = select([func.substr(column, offset + 1, size)], column.table.c.id == id)
+    return str(database.session.execute(query).scalar() or '')
+
+
+def blob_size(column, id):
+    """Return the size of a BLOB, without reading it"""
+    query = select([func.length(column)], column.table.c.id == id)
+    return database.session.execute(query).scalar() or 0
+
+
+class BlobIter(object):
+    """Iterator over the chunks of a BLOB"""
+
+    def __init__(self, column, id, start, stop, chunk_size=CHUNK_SIZE):
+        """Initialization
+
+        In:
+          - ``column`` -- the BLOB column
+          - ``id`` -- primary key of the row
+          - ``start`` -- position of the first byte to read
+          - ``stop`` -- position after the last byte to read
+          - ``chunk_size`` -- maximum size of the chunks
+        """
+        self.column = column
+        self.id = id
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        offset = self.start
+        while offset < self.stop:
+            chunk = read_chunk(self.column, self.id, offset, min(self.chunk_size, self.stop - offset))
+            if not chunk:
+                break
+
+            offset += len(chunk)
+            yield chunk
+
+    def app_iter_range(self, start, stop):
+        """Called by webob to only send the bytes asked by a ``Range`` header"""
+        stop = self.stop if stop is None else min(self.start + stop, self.stop)
+        return BlobIter(self.column, self.id, self.start + start, stop, self.chunk_size)
+
+
+class FileIter(object):
+    """Iterator over the chunks of an image of the blob store"""
+
+    def __init__(self, store, digest, start, stop, chunk_size=CHUNK_SIZE):
+        """Initialization
+
+        In:
+          - ``store`` -- the blob store
+          - ``digest`` -- digest of the image
+          - ``start`` -- position of the first byte to read
+          - ``stop`` -- position after the last byte to read
+          - ``chunk_size`` -- maximum size of the chunks
+        """
+        self.store = store
+        self.digest = digest
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        data = self.store.open(self.digest)
+        try:
+            for offset in range(self.start, self.stop, self.chunk_size):
+                yield data[offset:min(offset + self.chunk_size, self.stop)]
+        finally:
+            if data:
+                data.close()
+
+    def app_iter_range(self, start, stop):
+        stop = self.stop if stop is None else min(self.start + stop, self.stop)
+        return FileIter(self.store, self.digest, self.start + start, stop, self.chunk_size)
+
+
+def blob_digest(column, digest_column, id):
+    """Return the SHA-256 of a BLOB
+
+    The digest is read from ``digest_column``. If not already computed, the
+    BLOB is hashed by chunks and the digest stored.
+    """
+    table = column.table
+
+    digest = database.session.execute(select([digest_column], table.c.id == id)).scalar()
+    if digest is None:
+        h = hashlib.sha256()
+        for chunk in BlobIter(column, id, 0, blob_size(column, id)):
+            h.update(chunk)
+
+        digest = h.hexdigest()
+        database.session.execute(table.update(table.c.id == id, {digest_column.name: digest}))
+
+    return digest
+
+
+class BlobResponse(exc.HTTPOk):
+    """A ``200`` response that can be raised from an action
+
+    As ``conditional_response`` is set, webob answers with a ``304`` or a
+    ``206`` when needed, only consuming the parts of the ``app_iter`` it sends.
+    """
+    def __call__(self, environ, start_response):
+        # Don't let ``exc.HTTPOk`` read the body to check if there is one
+        return Response.__call__(self, environ, start_response)
+
+
+def serve(request, column, digest_column, id, content_type=None, vary=None, cached=False):
+    """Send a BLOB as the response of an image action
+
+    In:
+      - ``request`` -- the web request
+      - ``column`` -- the BLOB column
+      - ``digest_column`` -- the column where the digest of the BLOB is stored
+      - ``id`` -- primary key of the row
+      - ``content_type`` -- MIME type of the BLOB (sniffed if not given)
+      - ``vary`` -- the ``Vary`` header, when the BLOB depends on request headers
+      - ``cached`` -- keep the BLOB in the cache? Only for the small images,
+        as the thumbnails and the renditions
+    """
+    key = (column.table.name, column.name, id)
+    entry = cache.get(key) if cached else None
+
+    digest = blob_digest(column, digest_column, id) if entry is None else entry[0]
+    if digest in request.if_none_match:
+        raise exc.HTTPNotModified(etag=digest, vary=vary)
+
+    if entry is not None:
+        data = entry[1]
+        app_iter = [data]
+        size = len(data)
+    else:
+        store = blobstore.current()
+        if (store is not None) and store.exists(digest):
+            # The BLOB was moved to the blob store
+            size = store.size(digest)
+            app_iter = FileIter(store, digest, 0, size)
+        else:
+            size = blob_size(column, id)
+            app_iter = BlobIter(column, id, 0, size)
+
+        if cached and (request.range is None) and (size <= cache.max_item_bytes):
+            # Small enough to be read at once and cached. Never filled from a
+            # partial response, where only the range asked is streamed
+            data = ''.join(app_iter)
+            cache.put(key, (digest, data), size)
+            app_iter = [data]
+
+    if content_type is None:
+        head = app_iter[0][:32] if isinstance(app_iter, list) else ''.join(app_iter.app_iter_range(0, 32))
+        kind = imghdr.what(None, head)
+        content_type = ('image/' + kind) if kind else 'application/octet-stream'
+
+    raise BlobResponse(
+        app_iter=app_iter,
+        content_type=content_type,
+        content_length=size,
+        etag=digest,
+        accept_ranges='bytes',
+        vary=vary,
+        conditional_response=True
+    )
+
+
+# ---------------------------------------------------------------------------
+
+@presentation.render_for(lrucache.LRUCache)
+def render(self, h, *args):
+    stats = self.stats()
+    stats.update(kb=stats['bytes'] // 1024, max_kb=stats['max_bytes'] // 1024, percent=stats['hit_rate'] * 100)
+
+    return h.i('Images cache: %(entries)d images, %(kb)d/%(max_kb)d KB, %(percent).1f%% hits, %(evictions)d evictions' % stats)
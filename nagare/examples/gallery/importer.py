@@ -0,0 +1,288 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Bulk import of images into a gallery
+
+Usage: ``nagare-admin batch gallery7 nagare/examples/gallery/importer.py [options] <gallery> <directory or archive>``
+
+The images of a directory tree, or of a zip or tar archive, are read in a
+stable order. Their thumbnails and renditions are created by a pool of
+processes, then the photos are inserted by batches, one transaction per
+batch.
+
+After each batch, the number of images done is written into a checkpoint
+file, so that an interrupted import can be resumed. The images already in
+the gallery, identified by their digest, are never inserted twice.
+"""
+
+import os
+import sys
+import time
+import tarfile
+import itertools
+import zipfile
+import optparse
+import multiprocessing
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from nagare import database
+from nagare.examples.gallery import gallerydata, thumb, blobstore
+from nagare.examples.gallery.gallerydata import GalleryData, PhotoData, RenditionData, unique_slugs
+
+# Number of times a batch is inserted before giving up
+INSERT_ATTEMPTS = 3
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def is_image(name):
+    return os.path.splitext(name)[1].lower() in EXTENSIONS
+
+
+def read_sources(source):
+    """Generate the images to import, always in the same order
+
+    In:
+      - ``source`` -- a directory, a zip or a tar archive
+
+    Return:
+      - generator of (name, path, data). ``path`` is the file of the image, or
+        ``data`` its content when read from an archive
+    """
+    if os.path.isdir(source):
+        for (directory, dirs, files) in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if is_image(name):
+                    path = os.path.join(directory, name)
+                    yield os.path.relpath(path, source), path, None
+
+    elif zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        for name in sorted(archive.namelist()):
+            if is_image(name):
+                yield name, None, archive.read(name)
+
+    else:
+        archive = tarfile.open(source)
+        members = sorted((m for m in archive.getmembers() if m.isfile() and is_image(m.name)), key=lambda m: m.name)
+        for member in members:
+            yield member.name, None, archive.extractfile(member).read()
+
+
+def process(args):
+    """Executed in a worker process
+
+    In:
+      - ``args`` -- a tuple (name, path, data, renditions sizes, maximum number of pixels)
+
+    Return:
+      - a tuple (name, ``PhotoData`` row, ``RenditionData`` rows, error message)
+    """
+    (name, path, data, sizes, max_pixels) = args
+
+    try:
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+
+        (thumbnail, renditions) = thumb.derivatives(data, sizes, max_pixels)
+        metadata = dict(gallerydata.metadata(data), **gallerydata.thumbnail_metadata(thumbnail))
+
+        # With a blob store, the images are written by the workers
+        (img, img_digest) = blobstore.put(data)
+        (thumbnail, thumbnail_digest) = blobstore.put(thumbnail)
+
+        photo = dict(
+            title=os.path.splitext(os.path.basename(name))[0].decode('utf-8', 'replace')[:100],
+            img=img, img_digest=img_digest,
+            thumbnail=thumbnail, thumbnail_digest=thumbnail_digest,
+            thumbnail_status=u'ready', renditions_status=u'ready',
+            **metadata
+        )
+
+        rows = []
+        for (size, width, height, rendition) in renditions:
+            (rendition_data, digest) = blobstore.put(rendition)
+            rows.append(dict(size=size, width=width, height=height, data=rendition_data, digest=digest, data_size=len(rendition)))
+
+        return name, photo, rows, None
+    except Exception as e:
+        return name, None, None, str(e)
+
+
+def insert(gallery_id, results):
+    """Insert a batch of photos, in one transaction
+
+    In:
+      - ``gallery_id`` -- id of the gallery
+      - ``results`` -- list of ``process()`` results
+
+    Return:
+      - number of photos inserted
+    """
+    # A slug can still be taken by a concurrent transaction which doesn't lock
+    # the gallery: the whole batch is then inserted again, with new slugs
+    for attempt in range(INSERT_ATTEMPTS - 1):
+        try:
+            return insert_batch(gallery_id, results)
+        except IntegrityError:
+            pass
+
+    return insert_batch(gallery_id, results)
+
+
+def insert_batch(gallery_id, results):
+    """Insert a batch of photos, in one transaction
+
+    In:
+      - ``gallery_id`` -- id of the gallery
+      - ``results`` -- list of ``process()`` results
+
+    Return:
+      - number of photos inserted
+    """
+    photos = PhotoData.table
+    renditions = RenditionData.table
+
+    with database.session.begin():
+        # Images already imported, by a previous interrupted import
+        digests = [photo['img_digest'] for (name, photo, rows, error) in results]
+        query = select([photos.c.img_digest], (photos.c.gallery_id == gallery_id) & photos.c.img_digest.in_(digests))
+        existing = set(digest for (digest,) in database.session.execute(query))
+
+        photo_rows = []
+        for (name, photo, rows, error) in results:
+            if photo['img_digest'] not in existing:
+                existing.add(photo['img_digest'])
+                photo_rows.append((dict(photo, gallery_id=gallery_id), rows))
+
+        if not photo_rows:
+            return 0
+
+        slugs = unique_slugs(gallery_id, [photo['title'] for (photo, rows) in photo_rows])
+        database.session.execute(photos.insert(), [dict(photo, slug=slug) for ((photo, rows), slug) in zip(photo_rows, slugs)])
+
+        # The ids assigned by the database, found by the digests of the new
+        # photos, unique into the gallery
+        digests = [photo['img_digest'] for (photo, rows) in photo_rows]
+        query = select([photos.c.img_digest, photos.c.id], (photos.c.gallery_id == gallery_id) & photos.c.img_digest.in_(digests))
+        ids = dict(database.session.execute(query).fetchall())
+
+        rendition_rows = []
+        for (photo, rows) in photo_rows:
+            rendition_rows.extend(dict(row, photo_id=ids[photo['img_digest']]) for row in rows)
+
+        if rendition_rows:
+            database.session.execute(renditions.insert(), rendition_rows)
+
+    return len(photo_rows)
+
+
+def read_checkpoint(filename):
+    """Return the number of images already done"""
+    if not filename or not os.path.isfile(filename):
+        return 0
+
+    with open(filename) as f:
+        return int(f.read().strip() or 0)
+
+
+def write_checkpoint(filename, done):
+    if filename:
+        with open(filename + '.tmp', 'w') as f:
+            f.write('%d\n' % done)
+        os.rename(filename + '.tmp', filename)
+
+
+def import_images(
+    gallery_name, source,
+    checkpoint=None, processes=None, batch_size=100,
+    sizes=thumb.RENDITIONS, max_pixels=thumb.MAX_PIXELS, blobstore_root=None
+):
+    """Import the images of a directory or an archive into a gallery
+
+    In:
+      - ``gallery_name`` -- name of the gallery, created if needed
+      - ``source`` -- directory, zip or tar archive
+      - ``checkpoint`` -- file where the progress is saved
+      - ``processes`` -- number of worker processes (number of CPUs if ``None``)
+      - ``batch_size`` -- number of photos inserted by transaction
+      - ``sizes`` -- sizes of the renditions
+      - ``max_pixels`` -- maximum number of pixels of a decoded image
+      - ``blobstore_root`` -- directory of the blob store, if any
+    """
+    blobstore.configure(blobstore_root)
+
+    with database.session.begin():
+        gallery = GalleryData.get_by(name=gallery_name) or GalleryData(name=gallery_name)
+    gallery_id = gallery.id
+
+    done = skipped = read_checkpoint(checkpoint)
+    imported = failed = 0
+
+    def tasks():
+        for (i, (name, path, data)) in enumerate(read_sources(source)):
+            if i >= skipped:
+                yield name, path, data, sizes, max_pixels
+
+    tasks = tasks()
+    pool = multiprocessing.Pool(processes, blobstore.configure, (blobstore_root,))
+    start = time.time()
+
+    try:
+        while True:
+            # Only one batch of images is read at a time
+            batch = list(itertools.islice(tasks, batch_size))
+            if not batch:
+                break
+
+            results = []
+            for result in pool.map(process, batch, 1):
+                (name, photo, rows, error) = result
+                if error:
+                    print >> sys.stderr, '%s: %s' % (name, error)
+                    failed += 1
+                else:
+                    results.append(result)
+
+            imported += insert(gallery_id, results)
+            done += len(batch)
+            write_checkpoint(checkpoint, done)
+
+            elapsed = time.time() - start
+            print '%d images done, %d imported, %d failed, %.1f images/s' % (done, imported, failed, (done - skipped) / elapsed if elapsed else 0)
+    finally:
+        pool.terminate()
+
+    elapsed = time.time() - start
+    print '%d images imported, %d failed in %.1fs (%.1f images/s)' % (imported, failed, elapsed, (done - skipped) / elapsed if elapsed else 0)
+
+
+# Executed when loaded by ``nagare-admin batch``, its own arguments already
+# removed from ``sys.argv``
+parser = optparse.OptionParser(usage='%prog [options] <gallery> <directory or archive>')
+parser.add_option('-c', '--checkpoint', help='file where the progress is saved, to resume an interrupted import')
+parser.add_option('-j', '--processes', type='int', help='number of worker processes (default: number of CPUs)')
+parser.add_option('-n', '--batch-size', type='int', default=100, help='number of photos inserted by transaction')
+parser.add_option('-r', '--renditions', default=','.join(str(size) for size in thumb.RENDITIONS), help='sizes of the renditions')
+parser.add_option('-b', '--blobstore', help='directory of the blob store')
+(options, args) = parser.parse_args()
+
+if len(args) != 2:
+    parser.error('bad number of arguments')
+
+import_images(
+    args[0].decode('utf-8'), args[1],
+    options.checkpoint, options.processes, options.batch_size,
+    [int(size) for size in options.renditions.split(',') if size],
+    blobstore_root=options.blobstore
+)
@@ -0,0 +1,271 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Migration of an existing gallery database
+
+Usage: ``nagare-admin batch gallery7 nagare/examples/gallery/migrate.py``
+
+The columns added to the entities since the database was created are added
+to the tables, then the precomputed columns are filled.
+
+The sizes of the renditions, the maximum number of pixels of a decoded image
+and the blob store are read from the configuration of the application, as by
+the application itself. When a blob store is configured, the images are moved
+out of the database, into the store.
+"""
+
+from sqlalchemy import Table, MetaData, Index, select, func
+
+from nagare import database
+from nagare.examples.gallery import gallerydata, gallery7, thumbpool, thumb, blobstore
+from nagare.examples.gallery.gallerydata import PhotoData, RenditionData
+from nagare.examples.util.schema import add_missing_columns
+
+BATCH_SIZE = 100
+
+
+def check_images(store):
+    """Check the images already out of the database are into the blob store
+
+    In:
+      - ``store`` -- the blob store, ``None`` if the images are into the
+        database
+    """
+    table = PhotoData.table
+    query = select([table.c.img_digest], (table.c.img == None) & (table.c.img_digest != None)).limit(1)  # noqa: E711
+    digest = database.session.execute(query).scalar()
+
+    if (digest is not None) and ((store is None) or not store.exists(digest)):
+        raise ValueError('The images are out of the database, but not into the blob store %s' % (store.root if store else '(not configured)'))
+
+
+def add_missing_indexes(table):
+    """Create the indexes only defined by the entity
+
+    In:
+      - ``table`` -- the table, as defined by the entity
+    """
+    bind = table.bind
+    existing = Table(table.name, MetaData(), autoload=True, autoload_with=bind)
+    names = set(index.name for index in existing.indexes)
+
+    for index in table.indexes:
+        if index.name not in names:
+            print 'Adding index %s' % index.name
+            index.create(bind)
+
+
+def add_unique_conversions():
+    """Add the unique constraint of the conversions to an existing table
+
+    The conversions created twice, concurrently, are removed first
+    """
+    table = RenditionData.table
+    bind = table.bind
+
+    name = 'ix_%s_photo_size_format' % table.name
+    existing = Table(table.name, MetaData(), autoload=True, autoload_with=bind)
+    if name in set(index.name for index in existing.indexes):
+        return
+
+    kept = select([func.min(table.c.id)], table.c.format != None).group_by(table.c.photo_id, table.c.size, table.c.format)  # noqa: E711
+    with database.session.begin():
+        where = (table.c.format != None) & ~table.c.id.in_(kept)  # noqa: E711
+        removed = database.session.execute(table.delete(where)).rowcount
+    print '%d duplicated conversions removed' % removed
+
+    # A unique constraint can't be added to an existing table
+    print 'Adding unique index %s' % name
+    Index(name, table.c.photo_id, table.c.size, table.c.format, unique=True).create(bind)
+
+
+def backfill_metadata():
+    """Compute the size, dimensions and MIME type of the existing photos"""
+    table = PhotoData.table
+    query = select([table.c.id], table.c.img_size == None)  # noqa: E711
+
+    ids = [row.id for row in database.session.execute(query)]
+    for i in range(0, len(ids), BATCH_SIZE):
+        with database.session.begin():
+            for photo in PhotoData.query.filter(PhotoData.id.in_(ids[i:i + BATCH_SIZE])):
+                img = blobstore.get(photo.img, photo.img_digest)
+                if img is None:
+                    continue
+
+                photo.set(img_digest=gallerydata.digest(img), **gallerydata.metadata(img))
+                if photo.thumbnail is not None:
+                    photo.thumbnail_digest = gallerydata.digest(str(photo.thumbnail))
+
+        # Don't keep the loaded images in the identity map
+        database.session.expunge_all()
+
+        print '%d/%d photos updated' % (min(i + BATCH_SIZE, len(ids)), len(ids))
+
+
+def backfill_slugs():
+    """Create the slugs of the existing photos, unique into their gallery"""
+    table = PhotoData.table
+    query = select([table.c.id, table.c.gallery_id, table.c.title], table.c.slug == None).order_by(table.c.id)  # noqa: E711
+
+    rows = database.session.execute(query).fetchall()
+    for i in range(0, len(rows), BATCH_SIZE):
+        with database.session.begin():
+            for row in rows[i:i + BATCH_SIZE]:
+                slug = gallerydata.unique_slugs(row.gallery_id, [row.title])[0]
+                database.session.execute(table.update(table.c.id == row.id, {'slug': slug}))
+
+        print '%d/%d slugs created' % (min(i + BATCH_SIZE, len(rows)), len(rows))
+
+
+def backfill_previews():
+    """Compute the dimensions and the preview of the existing thumbnails"""
+    table = PhotoData.table
+
+    # The thumbnails created before their status existed are ready
+    with database.session.begin():
+        stored = (table.c.thumbnail != None) | (table.c.thumbnail_digest != None)  # noqa: E711
+        where = (table.c.thumbnail_status == None) & stored  # noqa: E711
+        database.session.execute(table.update(where, {'thumbnail_status': u'ready'}))
+
+    query = select([table.c.id], (table.c.preview == None) & (table.c.thumbnail_status == u'ready'))  # noqa: E711
+
+    ids = [row.id for row in database.session.execute(query)]
+    for i in range(0, len(ids), BATCH_SIZE):
+        with database.session.begin():
+            query = select([table.c.id, table.c.thumbnail, table.c.thumbnail_digest], table.c.id.in_(ids[i:i + BATCH_SIZE]))
+            for row in database.session.execute(query).fetchall():
+                thumbnail = blobstore.get(row.thumbnail, row.thumbnail_digest)
+                if thumbnail is None:
+                    continue
+
+                try:
+                    values = gallerydata.thumbnail_metadata(thumbnail)
+                except IOError:
+                    # Not an image format known by PIL
+                    continue
+
+                database.session.execute(table.update(table.c.id == row.id, values))
+
+        print '%d/%d previews created' % (min(i + BATCH_SIZE, len(ids)), len(ids))
+
+
+def backfill_renditions(sizes=thumb.RENDITIONS, max_pixels=thumb.MAX_PIXELS):
+    """Create the renditions of the photos not yet processed
+
+    The photos that can't be rendered are marked as ``failed``, so that each
+    photo is decoded only once, whatever the number of runs
+    """
+    table = PhotoData.table
+
+    # The renditions created before their status existed are ready
+    with database.session.begin():
+        rendered = select([RenditionData.table.c.photo_id])
+        where = (table.c.renditions_status == None) & table.c.id.in_(rendered)  # noqa: E711
+        database.session.execute(table.update(where, {'renditions_status': u'ready'}))
+
+    query = select([table.c.id], table.c.renditions_status == None)  # noqa: E711
+
+    ids = [row.id for row in database.session.execute(query)]
+    for (i, id) in enumerate(ids):
+        with database.session.begin():
+            photo = PhotoData.get(id)
+            img = blobstore.get(photo.img, photo.img_digest)
+            try:
+                if img is None:
+                    raise ValueError('No image')
+
+                renditions = thumb.derivatives(img, sizes, max_pixels)[1]
+            except Exception as e:
+                # No image, image not decodable or too large
+                print 'Photo %d not rendered: %s' % (id, e)
+                photo.renditions_status = u'failed'
+            else:
+                for (size, width, height, data) in renditions:
+                    photo.renditions.append(RenditionData(size=size, width=width, height=height, data=data))
+                photo.renditions_status = u'ready'
+
+        database.session.expunge_all()
+        print '%d/%d photos rendered' % (i + 1, len(ids))
+
+
+def move_to_store(table, column, digest_column):
+    """Move the BLOBs of a column into the blob store
+
+    In:
+      - ``table`` -- the table
+      - ``column`` -- name of the BLOB column
+      - ``digest_column`` -- name of the column of the BLOB digests
+    """
+    column = table.c[column]
+    digest_column = table.c[digest_column]
+
+    ids = [row.id for row in database.session.execute(select([table.c.id], column != None))]  # noqa: E711
+    for i in range(0, len(ids), BATCH_SIZE):
+        with database.session.begin():
+            query = select([table.c.id, column], table.c.id.in_(ids[i:i + BATCH_SIZE]))
+            for row in database.session.execute(query).fetchall():
+                digest = blobstore.current().put(str(row[column]))
+                database.session.execute(table.update(table.c.id == row.id, {column.name: None, digest_column.name: digest}))
+
+        print '%s.%s: %d/%d images moved' % (table.name, column.name, min(i + BATCH_SIZE, len(ids)), len(ids))
+
+
+def migrate(store=None, sizes=thumb.RENDITIONS, max_pixels=thumb.MAX_PIXELS):
+    """Migrate the database
+
+    In:
+      - ``store`` -- the blob store where the images are moved, if any
+      - ``sizes`` -- sizes of the renditions to create
+      - ``max_pixels`` -- maximum number of pixels of an image decoded
+    """
+    # The tables created now already have their unique constraints
+    renditions_existed = RenditionData.table.exists()
+
+    gallerydata.__metadata__.create_all()
+    added = add_missing_columns(PhotoData.table)
+
+    # Before any change of the photos
+    check_images(store)
+    blobstore.use(store)
+
+    add_missing_indexes(PhotoData.table)
+
+    backfill_slugs()
+    if 'slug' in added:
+        # A unique constraint can't be added to an existing table
+        table = PhotoData.table
+        print 'Adding unique index on %s (gallery_id, slug)' % table.name
+        Index('ix_%s_gallery_slug' % table.name, table.c.gallery_id, table.c.slug, unique=True).create(table.bind)
+
+    add_missing_columns(RenditionData.table)
+    add_missing_indexes(RenditionData.table)
+    if renditions_existed:
+        add_unique_conversions()
+
+    backfill_metadata()
+    backfill_previews()
+    backfill_renditions(sizes, max_pixels)
+
+    if store is not None:
+        move_to_store(PhotoData.table, 'img', 'img_digest')
+        move_to_store(PhotoData.table, 'thumbnail', 'thumbnail_digest')
+        move_to_store(RenditionData.table, 'data', 'digest')
+
+        # Give the space of the BLOBs back to the filesystem
+        if PhotoData.table.bind.dialect.name == 'sqlite':
+            PhotoData.table.bind.execute('VACUUM')
+
+
+# Executed when loaded by ``nagare-admin batch``. The ``apps`` global are the
+# applications given to the command, already configured
+app = next((app for app in apps.values() if isinstance(app, gallery7.WSGIApp)), None)  # noqa: F821
+if app is None:
+    raise ValueError('The gallery7 application is not loaded')
+
+migrate(app.blobstore, thumbpool.pool.renditions, thumbpool.pool.max_pixels)
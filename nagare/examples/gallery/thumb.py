@@ -14,9 +14,55 @@ except ImportError:
     import ImageFilter
     import ImageDraw
 
+import math
+import base64
 import StringIO
 
 
+# Cache of the blurred shadow masks, keyed by the size of the image, the
+# offset, the border and the number of iterations
+MASKS_CACHE_SIZE = 512
+masks = {}
+
+
+def shadowMask(size, offset=(5, 5), border=8, iterations=3):
+    """
+    Create, or get from the cache, the blurred mask of a shadow.
+
+    In:
+      - ``size`` -- Size of the image as a (w, h) tuple.
+      - ``offset``, ``border``, ``iterations`` -- see ``dropShadow()``
+
+    Return:
+      - a 'L' mode image, 255 where the shadow is fully opaque
+    """
+    key = (size[0], size[1], offset, border, iterations)
+
+    mask = masks.get(key)
+    if mask is None:
+        totalWidth = size[0] + abs(offset[0]) + 2 * border
+        totalHeight = size[1] + abs(offset[1]) + 2 * border
+        mask = Image.new('L', (totalWidth, totalHeight), 0)
+
+        shadowLeft = border + max(offset[0], 0)
+        shadowTop = border + max(offset[1], 0)
+        mask.paste(255, [shadowLeft, shadowTop, shadowLeft + size[0], shadowTop + size[1]])
+
+        if hasattr(ImageFilter, 'GaussianBlur'):
+            # One separable gaussian blur with the same variance than the
+            # ``iterations`` passes of the 5x5 ``BLUR`` kernel
+            mask = mask.filter(ImageFilter.GaussianBlur(math.sqrt(2.75 * iterations)))
+        else:
+            for i in range(iterations):
+                mask = mask.filter(ImageFilter.BLUR)
+
+        if len(masks) >= MASKS_CACHE_SIZE:
+            masks.clear()
+        masks[key] = mask
+
+    return mask
+
+
 def dropShadow(
     image, offset=(5, 5),
     background=0xffffff, shadow=0x444444, border=8,
@@ -36,26 +82,18 @@ def dropShadow(
       - ``iterations`` -- Number of times to apply the filter.  More iterations
         produce a more blurred shadow, but increase processing time.
 
-    The author of this function is Kevin Schluff:
+    The author of the original function is Kevin Schluff:
       http://code.activestate.com/recipes/474116/
+
+    As the blur is linear, only the mask of the shadow is blurred, then the
+    shadow colour is pasted through it. The masks only depend on the image
+    size, so they are cached.
     """
     # Create the backdrop image -- a box in the background colour with a
     # shadow on it.
-    totalWidth = image.size[0] + abs(offset[0]) + 2 * border
-    totalHeight = image.size[1] + abs(offset[1]) + 2 * border
-    back = Image.new(image.mode, (totalWidth, totalHeight), background)
-
-    # Place the shadow, taking into account the offset from the image
-    shadowLeft = border + max(offset[0], 0)
-    shadowTop = border + max(offset[1], 0)
-    back.paste(shadow, [shadowLeft, shadowTop, shadowLeft + image.size[0], shadowTop + image.size[1]])
-
-    # Apply the filter to blur the edges of the shadow.  Since a small kernel
-    # is used, the filter must be applied repeatedly to get a decent blur.
-    n = 0
-    while n < iterations:
-        back = back.filter(ImageFilter.BLUR)
-        n += 1
+    mask = shadowMask(image.size, offset, border, iterations)
+    back = Image.new(image.mode, mask.size, background)
+    back.paste(shadow, (0, 0) + mask.size, mask)
 
     # Paste the input image onto the shadow backdrop
     imageLeft = border - min(offset[0], 0)
@@ -78,21 +116,284 @@ def outline(image, border=5, color=0x000000):
     return back
 
 
-def thumbnail(image):
-    thumb = Image.open(StringIO.StringIO(image))
-    format = thumb.format
+def open_image(image):
+    """Open, without decoding it, an image
+
+    In:
+      - ``image`` -- the image data or a file object
+    """
+    return Image.open(image if hasattr(image, 'read') else StringIO.StringIO(image))
+
+
+def info(image):
+    """Read the metadata of an image, without decoding its pixels
+
+    In:
+      - ``image`` -- the image data or a file object
+
+    Return:
+      - a tuple (width, height, MIME type)
+    """
+    img = open_image(image)
+    (width, height) = img.size
+
+    return width, height, Image.MIME.get(img.format, 'image/' + img.format.lower())
 
-    if thumb.mode == 'P':
-        thumb.thumbnail((200, 200))
+
+def resize(img, size):
+    """Resize, in place, an image to fit into a ``size`` x ``size`` box"""
+    if img.mode == 'P':
+        img.thumbnail((size, size))
     else:
-        thumb.thumbnail((200, 200), Image.ANTIALIAS)
+        img.thumbnail((size, size), Image.ANTIALIAS)
+
+
+def decorate(thumb):
+    """Resize an image to a 200x200 thumbnail, with an outline and a shadow"""
+    resize(thumb, 200)
+    if thumb.mode != 'P':
         thumb = dropShadow(outline(thumb, border=8, color=0x666666), shadow=0x666666)
 
+    return thumb
+
+
+def encode(img, format, **options):
     i = StringIO.StringIO()
-    thumb.save(i, format)
+    img.save(i, format, **options)
     return i.getvalue()
 
 
+def preview(img, size=16):
+    """Tiny preview of an image, inlined into the pages while the image loads
+
+    In:
+      - ``img`` -- the decoded image
+      - ``size`` -- the preview fits into a ``size`` x ``size`` box
+
+    Return:
+      - the preview, as a ``data:`` URI
+    """
+    img = img.copy()
+    img.thumbnail((size, size))
+
+    # The transparent parts are flattened on a white background
+    img = img.convert('RGBA')
+    back = Image.new('RGB', img.size, 0xffffff)
+    back.paste(img, (0, 0), img)
+
+    return 'data:image/png;base64,' + base64.b64encode(encode(back, 'PNG', optimize=True))
+
+
+# Maximum number of pixels of an image to decode. Above, the image is refused
+# to bound the memory used
+MAX_PIXELS = 50 * 1000 * 1000
+
+
+# The images are decoded at least this factor larger than the size they are
+# resized to
+DRAFT_GAP = 1.5
+
+
+def draft_box(size, target):
+    """Box, with the aspect ratio of an image, whose long side is
+    ``DRAFT_GAP`` times the size the image is resized to
+
+    In:
+      - ``size`` -- the (width, height) of the image
+      - ``target`` -- the image will be resized to fit into a ``target`` x ``target`` box
+    """
+    (width, height) = size
+    scale = min(1., target * DRAFT_GAP / max(width, height))
+
+    return max(1, int(math.ceil(width * scale))), max(1, int(math.ceil(height * scale)))
+
+
+def decoded_size(size, mime, target):
+    """Size of an image once decoded by ``load()``, without decoding it
+
+    As ``Image.draft()``, the JPEG images are decoded at 1/2, 1/4 or 1/8 scale,
+    the largest reduction still larger than the ``draft_box()``
+
+    In:
+      - ``size`` -- the (width, height) of the image
+      - ``mime`` -- MIME type of the image
+      - ``target`` -- the image will be resized to fit into a ``target`` x ``target`` box
+    """
+    if mime != 'image/jpeg':
+        return size
+
+    (width, height) = size
+    box = draft_box(size, target)
+    ratio = min(width // box[0], height // box[1])
+    scale = max([scale for scale in (1, 2, 4, 8) if scale <= ratio] or [1])
+
+    return (width + scale - 1) // scale, (height + scale - 1) // scale
+
+
+def largest_size(size, sizes):
+    """The size the image is first resized to by ``derivatives()``
+
+    In:
+      - ``size`` -- the (width, height) of the image
+      - ``sizes`` -- sizes of the renditions
+    """
+    return max([s for s in sizes if s < max(size)] or [200])
+
+
+def load(img, size, max_pixels=MAX_PIXELS):
+    """Decode an image, at the smallest scale still adequate for a resize
+
+    The JPEG images are decoded directly at 1/2, 1/4 or 1/8 scale. The other
+    images are reduced by an integer factor before their high quality resize.
+
+    In:
+      - ``img`` -- the not yet decoded image
+      - ``size`` -- the image will be resized to fit into a ``size`` x ``size`` box
+      - ``max_pixels`` -- maximum number of pixels of the decoded image, once
+        reduced
+
+    Return:
+      - the decoded image, at least ``DRAFT_GAP`` times larger than ``size``,
+        if possible
+    """
+    if img.mode != 'P':
+        # The size of the image becomes the size it will be decoded at
+        img.draft(img.mode, draft_box(img.size, size))
+
+    if img.size[0] * img.size[1] > max_pixels:
+        raise ValueError('Image too large (%dx%d pixels)' % img.size)
+
+    img.load()
+
+    factor = int(max(img.size) // (size * DRAFT_GAP))
+    if (factor > 1) and (img.mode != 'P') and hasattr(img, 'reduce'):
+        img = img.reduce(factor)
+
+    return img
+
+
+def thumbnail(image, max_pixels=MAX_PIXELS):
+    thumb = open_image(image)
+    format = thumb.format
+
+    return encode(decorate(load(thumb, 200, max_pixels)), format)
+
+
+# Default sizes of the renditions of a photo
+RENDITIONS = (640, 1280, 2048)
+
+
+def derivatives(image, sizes=RENDITIONS, max_pixels=MAX_PIXELS):
+    """Create the thumbnail and the renditions of an image
+
+    The image is decoded only once, at the scale of the largest rendition,
+    then successively reduced from the largest rendition to the thumbnail.
+
+    In:
+      - ``image`` -- the image data or a file object
+      - ``sizes`` -- sizes of the boxes the renditions must fit in. No
+        rendition is created for a size not smaller than the image
+      - ``max_pixels`` -- maximum number of pixels of the decoded image
+
+    Return:
+      - a tuple (thumbnail data, list of (size, width, height, rendition data))
+    """
+    img = open_image(image)
+    format = img.format
+
+    sizes = sorted([size for size in sizes if size < max(img.size)], reverse=True)
+    img = load(img, largest_size(img.size, sizes), max_pixels)
+
+    renditions = []
+    for size in sizes:
+        resize(img, size)
+        renditions.append((size, img.size[0], img.size[1], encode(img, format)))
+
+    return encode(decorate(img), format), renditions
+
+
+# The formats the thumbnails and the renditions can be converted to, by
+# preference: MIME type, PIL format and encoding options
+CONVERSIONS = (
+    ('image/avif', 'AVIF', {'quality': 60}),
+    ('image/webp', 'WEBP', {'quality': 80, 'method': 4})
+)
+
+
+def conversions():
+    """The MIME types of the ``CONVERSIONS`` supported by PIL"""
+    Image.init()
+    return [mime for (mime, format, options) in CONVERSIONS if format in Image.SAVE]
+
+
+def convert(image, mime):
+    """Convert an image to another format
+
+    In:
+      - ``image`` -- the image data or a file object
+      - ``mime`` -- MIME type of one of the ``CONVERSIONS``
+
+    Return:
+      - the converted image data
+    """
+    img = open_image(image)
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if ('transparency' in img.info) or ('A' in img.mode) else 'RGB')
+
+    (format, options) = [(format, options) for (m, format, options) in CONVERSIONS if m == mime][0]
+    return encode(img, format, **options)
+
+
+# Cache of the sprite sheets, keyed by the digests of their thumbnails
+SPRITES_CACHE_SIZE = 64
+sprites = {}
+
+
+def sprite(key, thumbnails, columns=6):
+    """
+    Compose thumbnails into one sprite sheet, or get it from the cache.
+
+    In:
+      - ``key`` -- key of the sheet into the cache. It must change when the
+        thumbnails change
+      - ``thumbnails`` -- iterable of the thumbnails data, only read when the
+        sheet is not in the cache
+      - ``columns`` -- number of thumbnails by row
+
+    Return:
+      - a tuple (sheet data, MIME type, list of the (x, y, width, height)
+        boxes of the thumbnails into the sheet)
+    """
+    sheet = sprites.get(key)
+    if sheet is None:
+        images = [open_image(data) for data in thumbnails]
+        (width, height) = (max(img.size[0] for img in images), max(img.size[1] for img in images))
+        rows = (len(images) + columns - 1) // columns
+
+        back = Image.new('RGB', (width * min(columns, len(images)), height * rows), 0xffffff)
+
+        boxes = []
+        for (i, img) in enumerate(images):
+            (x, y) = ((i % columns) * width, (i // columns) * height)
+            if img.mode in ('RGB', 'L'):
+                back.paste(img, (x, y))
+            else:
+                # The transparent thumbnails are pasted through their alpha channel
+                img = img.convert('RGBA')
+                back.paste(img, (x, y), img)
+
+            boxes.append((x, y) + img.size)
+
+        sheet = (encode(back, 'JPEG', quality=90), 'image/jpeg', boxes)
+
+        if len(sprites) >= SPRITES_CACHE_SIZE:
+            sprites.clear()
+        sprites[key] = sheet
+
+    return sheet
+
+
 # ---------------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -0,0 +1,347 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Generation of the thumbnails by a pool of processes
+
+The request threads only submit the images. Their thumbnails and renditions
+are created in other processes then stored into the database, where the photo
+stays in the ``pending`` state until then.
+
+The images submitted during a transaction are only sent to the workers once
+the photos are committed, whatever the application adding them. When all the
+workers are busy, the photos stay ``pending`` and are sent as soon as a
+thumbnail is done. The photos still ``pending`` when a process starts, left
+by a previous one, are submitted again.
+"""
+
+import time
+import logging
+import threading
+import multiprocessing
+
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+
+from nagare import database, presentation
+
+from gallerydata import PhotoData, RenditionData
+import gallerydata
+import imgresponse
+import blobstore
+import thumb
+
+# The results are stored by the thread of the pool, outside of any request
+logger = logging.getLogger(__name__)
+
+
+def create_derivatives(img, path, sizes, max_pixels):
+    """Executed in a worker process
+
+    In:
+      - ``img`` -- the image data, if not in the blob store
+      - ``path`` -- the file of the image in the blob store
+
+    Return:
+      - a tuple (``True``, ``thumb.derivatives()`` result) or (``False``, error message)
+    """
+    try:
+        if path is None:
+            return True, thumb.derivatives(img, sizes, max_pixels)
+
+        with open(path, 'rb') as f:
+            return True, thumb.derivatives(f, sizes, max_pixels)
+    except Exception as e:
+        return False, str(e)
+
+
+class ThumbnailPool(object):
+    def __init__(self, processes=None, max_pending=32, renditions=thumb.RENDITIONS, max_pixels=thumb.MAX_PIXELS):
+        """Initialization
+
+        In:
+          - ``processes`` -- number of worker processes (number of CPUs if ``None``)
+          - ``max_pending`` -- maximum number of images sent to the workers.
+            When reached, the photos stay ``pending`` until a worker is free
+          - ``renditions`` -- sizes of the renditions to create
+          - ``max_pixels`` -- maximum number of pixels of an image decoded by a worker
+        """
+        self.pool = None
+        self.lock = threading.Lock()
+        self.configure(processes, max_pending, renditions, max_pixels)
+
+        # The images submitted by the current transaction
+        self.submissions = threading.local()
+        # The ids of the photos submitted or sent to the workers
+        self.running = set()
+        # Are there ``pending`` photos not yet sent, left by a previous process
+        # or submitted while all the slots were taken? Only looked for once the
+        # pool is configured or used by the application
+        self.requeue_needed = False
+
+        self.started = time.time()
+        self.submitted = self.completed = self.failed = self.queued = 0
+        self.processing_time = 0.
+
+        # The images are sent after the commit of any session, in any thread
+        event.listen(Session, 'after_commit', lambda session: self.after_commit())
+        event.listen(Session, 'after_rollback', lambda session: self.cancel_submitted())
+
+    def configure(self, processes=None, max_pending=32, renditions=thumb.RENDITIONS, max_pixels=thumb.MAX_PIXELS):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.renditions = tuple(renditions)
+        self.max_pixels = max_pixels
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.requeue_needed = True
+
+    @property
+    def pending(self):
+        return self.submitted - self.completed - self.failed
+
+    def submit(self, photo):
+        """Create the thumbnail and the renditions of a photo
+
+        The photo is sent to the workers after the commit of the current
+        transaction. When all the slots are taken, it stays ``pending``
+        until a worker is free.
+
+        In:
+          - ``photo`` -- the ``PhotoData``, with its image just stored
+        """
+        photo.thumbnail_status = u'pending'
+        database.session.flush()
+
+        with self.lock:
+            if self.pool is None:
+                # First photo of this process: the ``pending`` photos of a
+                # previous one are also sent
+                self.requeue_needed = True
+
+        if not self.slots.acquire(False):
+            # Queue full: sent by ``run_submitted()`` after the next thumbnail done
+            with self.lock:
+                self.queued += 1
+                self.requeue_needed = True
+            return
+
+        # The workers directly read the images of the blob store
+        store = blobstore.current()
+        (img, path) = (photo.img, None) if store is None else (None, store.path(photo.img_digest))
+
+        with self.lock:
+            self.running.add(photo.id)
+
+        if not hasattr(self.submissions, 'images'):
+            self.submissions.images = []
+        self.submissions.images.append((photo.id, time.time(), img, path))
+
+        if not database.session.is_active:
+            # No transaction: the photo is already committed
+            self.run_submitted()
+
+    def run_submitted(self):
+        """Send to the workers the images submitted by the current thread,
+        then the ``pending`` photos not yet sent, as much as the free slots
+
+        Called after each commit
+        """
+        images = getattr(self.submissions, 'images', None) or []
+        self.submissions.images = []
+
+        with self.lock:
+            (requeue, self.requeue_needed) = (self.requeue_needed, False)
+
+        if requeue:
+            images.extend(self.pending_images())
+
+        if not images:
+            return
+
+        with self.lock:
+            if self.pool is None:
+                # Lazily created, after the application server has forked
+                self.pool = multiprocessing.Pool(self.processes)
+
+            self.submitted += len(images)
+
+        # The results are stored into the blob store of the application
+        store = blobstore.current()
+        for (id, start, img, path) in images:
+            self.pool.apply_async(
+                create_derivatives, (img, path, self.renditions, self.max_pixels),
+                callback=lambda result, id=id, start=start: self.done(id, start, result, store)
+            )
+
+    def after_commit(self):
+        """Any error is logged, not raised into the already done commit"""
+        try:
+            self.run_submitted()
+        except Exception:
+            logger.exception('Thumbnails not submitted')
+
+    def cancel_submitted(self):
+        """Forget the images submitted by the current thread
+
+        Called after each rollback: the photos no longer exist
+        """
+        images = getattr(self.submissions, 'images', None) or []
+        self.submissions.images = []
+
+        for (id, start, img, path) in images:
+            with self.lock:
+                self.running.discard(id)
+            self.slots.release()
+
+    def pending_images(self):
+        """The ``pending`` photos not sent to the workers by this process, as
+        much as the free slots
+
+        Return:
+          - list of (id, start, img, path)
+        """
+        table = PhotoData.table
+
+        query = select([table.c.id, table.c.img, table.c.img_digest], table.c.thumbnail_status == u'pending')
+        with self.lock:
+            if self.running:
+                query = query.where(~table.c.id.in_(list(self.running)))
+        query = query.order_by(table.c.id).limit(self.max_pending)
+
+        # Read out of the session, maybe called while it commits
+        rows = table.bind.execute(query).fetchall()
+
+        images = []
+        store = blobstore.current()
+        for (id, img, img_digest) in rows:
+            if not self.slots.acquire(False):
+                # The others are sent after the next thumbnail done
+                with self.lock:
+                    self.requeue_needed = True
+                return images
+
+            with self.lock:
+                self.running.add(id)
+
+            path = None if (store is None) or (img is not None) else store.path(img_digest)
+            images.append((id, time.time(), None if img is None else str(img), path))
+
+        if len(rows) == self.max_pending:
+            # Maybe more
+            with self.lock:
+                self.requeue_needed = True
+
+        return images
+
+    def done(self, id, start, result, store):
+        """Called in the result thread of the pool
+
+        Any error is caught, so that the thread still handles the next
+        results. The commit of the result sends the next ``pending``
+        photos, if any
+
+        In:
+          - ``store`` -- the blob store of the application, if any
+        """
+        self.slots.release()
+        self.count(start, result)
+        blobstore.use(store)
+
+        table = PhotoData.table
+        try:
+            with self.lock:
+                self.running.discard(id)
+
+            with database.session.begin():
+                # Not updated if already done, from another process
+                where = (table.c.id == id) & (table.c.thumbnail_status == u'pending')
+                updated = database.session.execute(table.update(where, self.values(result))).rowcount
+
+                renditions = self.renditions_values(result)
+                if updated and renditions:
+                    for rendition in renditions:
+                        data = rendition['data']
+                        (rendition['data'], rendition['digest']) = blobstore.put(data)
+                        rendition.update(photo_id=id, data_size=len(data))
+                    database.session.execute(RenditionData.table.insert(), renditions)
+
+            if updated:
+                imgresponse.invalidate(table.c.thumbnail, id)
+        except Exception:
+            logger.exception('Thumbnail of the photo %d not stored' % id)
+
+            try:
+                with database.session.begin():
+                    database.session.execute(table.update(table.c.id == id, dict(thumbnail_status=u'failed', renditions_status=u'failed')))
+            except Exception:
+                logger.exception('Photo %d not marked as failed' % id)
+        finally:
+            database.session.remove()
+
+    def count(self, start, result):
+        with self.lock:
+            self.processing_time += time.time() - start
+            if result[0]:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    @staticmethod
+    def values(result):
+        """The ``PhotoData`` columns to update with a thumbnail result"""
+        (ok, data) = result
+        if not ok:
+            return dict(thumbnail_status=u'failed', renditions_status=u'failed')
+
+        (thumbnail, thumbnail_digest) = blobstore.put(data[0])
+        return dict(
+            thumbnail=thumbnail, thumbnail_digest=thumbnail_digest, thumbnail_status=u'ready', renditions_status=u'ready',
+            **gallerydata.thumbnail_metadata(data[0])
+        )
+
+    @staticmethod
+    def renditions_values(result):
+        """The ``RenditionData`` rows to create from a thumbnail result"""
+        (ok, data) = result
+        if not ok:
+            return []
+
+        return [dict(size=size, width=width, height=height, data=rendition) for (size, width, height, rendition) in data[1]]
+
+    def stats(self):
+        """Metrics of the pool
+
+        Return:
+          - a dictionary with the ``pending`` (sent to the workers, not yet
+            done), ``submitted``, ``completed``, ``failed`` and ``queued``
+            (submitted while all the slots were taken) counters, the
+            ``throughput`` in thumbnails per second and the mean ``latency``
+            in seconds
+        """
+        with self.lock:
+            done = self.completed + self.failed
+
+            return dict(
+                pending=self.pending,
+                submitted=self.submitted,
+                completed=self.completed,
+                failed=self.failed,
+                queued=self.queued,
+                throughput=done / (time.time() - self.started),
+                latency=(self.processing_time / done) if done else 0.
+            )
+
+
+@presentation.render_for(ThumbnailPool)
+def render(self, h, *args):
+    return h.i('Thumbnails: %(pending)d pending, %(completed)d done, %(failed)d failed, '
+               '%(throughput).2f/s, %(latency).2fs mean latency' % self.stats())
+
+
+# The pool shared by all the sessions
+pool = ThumbnailPool()
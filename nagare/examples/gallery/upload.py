@@ -0,0 +1,130 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Spooling of the uploaded images
+
+An upload is read by chunks. The small ones are kept in memory, the others
+are copied into a temporary file. Its digest, its size and its format are
+computed while the chunks are read, so that an invalid upload is refused
+as soon as possible.
+"""
+
+import os
+import hashlib
+import tempfile
+import StringIO
+
+import thumb
+
+CHUNK_SIZE = 64 * 1024
+# Uploads above this size are spooled to a temporary file
+SPOOL_THRESHOLD = 1024 * 1024
+# Maximum size of an upload
+MAX_SIZE = 50 * 1024 * 1024
+# Maximum size of the header of an image, where its format and dimensions are
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+class Upload(object):
+    """An uploaded image
+
+    Only the name of its temporary file is kept, so it can be pickled with
+    the session
+    """
+    def __init__(self, data, path, digest, size, width, height, mime):
+        self.data = data
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.width = width
+        self.height = height
+        self.mime = mime
+
+    def open(self):
+        """Return a file object on the image data"""
+        return StringIO.StringIO(self.data) if self.path is None else open(self.path, 'rb')
+
+    def read(self):
+        if self.path is None:
+            return self.data
+
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def discard(self):
+        """Remove the temporary file, if any"""
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
+
+
+def spool(f, max_size=MAX_SIZE, threshold=SPOOL_THRESHOLD, chunk_size=CHUNK_SIZE):
+    """Read an upload
+
+    In:
+      - ``f`` -- file object of the upload
+      - ``max_size`` -- maximum size of the image
+      - ``threshold`` -- the images larger than ``threshold`` are copied into
+        a temporary file
+      - ``chunk_size`` -- size of the chunks read
+
+    Return:
+      - an ``Upload`` object
+    """
+    h = hashlib.sha256()
+    size = 0
+    header = ''
+    info = None
+
+    buffer = out = StringIO.StringIO()
+    path = None
+
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError('Image too large')
+
+            if info is None:
+                # The format is sniffed as soon as enough bytes of the image
+                # header are read
+                header += chunk
+                try:
+                    info = thumb.info(header)
+                    header = None
+                except IOError:
+                    if len(header) > MAX_HEADER_SIZE:
+                        raise ValueError('Unknown image format')
+
+            h.update(chunk)
+
+            if (path is None) and (size > threshold):
+                (fd, path) = tempfile.mkstemp(prefix='upload')
+                out = os.fdopen(fd, 'wb')
+                out.write(buffer.getvalue())
+                buffer = None
+
+            out.write(chunk)
+
+        if info is None:
+            raise ValueError('Unknown image format')
+    except Exception:
+        if path is not None:
+            out.close()
+            os.remove(path)
+        raise
+
+    if path is None:
+        data = buffer.getvalue()
+    else:
+        out.close()
+        data = None
+
+    (width, height, mime) = info
+    return Upload(data, path, h.hexdigest(), size, width, height, mime)
@@ -0,0 +1,36 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Measures of the benchmarks
+
+Used by the benchmarks of the gallery and of the wiki.
+"""
+
+import time
+
+
+def timeit(f, repeat=5, number=10):
+    """Best time of a function
+
+    In:
+      - ``f`` -- function to call without parameters
+      - ``repeat`` -- number of measures
+      - ``number`` -- number of calls by measure
+
+    Return:
+      - the best time of a call, in milliseconds
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        for j in range(number):
+            f()
+        times.append((time.time() - start) / number)
+
+    return min(times) * 1000
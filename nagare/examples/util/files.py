@@ -0,0 +1,43 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Files written so that they are never read partially
+
+Used by the blob store of the gallery and by the rendered pages of the wiki.
+"""
+
+import os
+import tempfile
+
+
+def create_file(path, chunks):
+    """Atomically create a file, so that a partial file is never read
+
+    In:
+      - ``path`` -- location of the file, its directory created if needed
+      - ``chunks`` -- the data of the file, by chunks
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created concurrently
+            pass
+
+    (fd, tmp) = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+        os.rename(tmp, path)
+    except BaseException:
+        # No temporary file is left behind
+        os.remove(tmp)
+        raise
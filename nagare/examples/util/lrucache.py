@@ -0,0 +1,125 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""In-process cache bounded by the total size of its values
+
+The least recently used values are evicted first. The cache is shared by all
+the threads of the process.
+
+Used by the images of the gallery and by the rendered pages of the wiki.
+"""
+
+import threading
+import collections
+
+
+class LRUCache(object):
+    def __init__(self, max_bytes, max_item_bytes=None):
+        """Initialization
+
+        In:
+          - ``max_bytes`` -- maximum total size of the values
+          - ``max_item_bytes`` -- the larger values are never kept (the
+            eighth of ``max_bytes`` if ``None``)
+        """
+        self.lock = threading.Lock()
+        self.items = collections.OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+        self.configure(max_bytes, max_item_bytes)
+
+    def configure(self, max_bytes, max_item_bytes=None):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.max_item_bytes = (max_bytes // 8) if max_item_bytes is None else max_item_bytes
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used values until the cache fits into
+        its size. Called with the lock acquired
+        """
+        while self.size > self.max_bytes:
+            (key, (value, size)) = self.items.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def get(self, key):
+        """Return the value of a key or ``None``"""
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+
+            # Now the most recently used
+            self.items[key] = item
+            self.hits += 1
+
+            return item[0]
+
+    def put(self, key, value, size):
+        """Keep a value
+
+        In:
+          - ``key`` -- the key
+          - ``value`` -- the value
+          - ``size`` -- the size of the value, in bytes
+
+        Return:
+          - is the value kept?
+        """
+        if size > self.max_item_bytes:
+            return False
+
+        with self.lock:
+            self.remove(key)
+
+            self.items[key] = (value, size)
+            self.size += size
+            self.evict()
+
+        return True
+
+    def remove(self, key):
+        """Remove a key, if cached. Called with the lock acquired"""
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def discard(self, key):
+        """Remove a key, if cached"""
+        with self.lock:
+            self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def stats(self):
+        """Metrics of the cache
+
+        Return:
+          - a dictionary with the number of ``entries``, their size in
+            ``bytes``, the ``max_bytes`` budget, the ``hits``, ``misses`` and
+            ``evictions`` counters and the ``hit_rate``
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+
+            return dict(
+                entries=len(self.items),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=(float(self.hits) / requests) if requests else 0.
+            )
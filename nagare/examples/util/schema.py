@@ -0,0 +1,37 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Migration of the tables of an existing database
+
+Used by the migration scripts of the gallery and of the wiki.
+"""
+
+from sqlalchemy import Table, MetaData
+
+
+def add_missing_columns(table):
+    """Add to the database table the columns only defined by the entity
+
+    In:
+      - ``table`` -- the table, as defined by the entity
+
+    Return:
+      - the names of the columns added
+    """
+    bind = table.bind
+    existing = Table(table.name, MetaData(), autoload=True, autoload_with=bind)
+
+    added = []
+    for column in table.columns:
+        if column.name not in existing.c:
+            print 'Adding column %s.%s' % (table.name, column.name)
+            bind.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name, column.type.compile(bind.dialect)))
+            added.append(column.name)
+
+    return added
@@ -0,0 +1,279 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Benchmarks of the pages rendering
+
+Usage: ``python bench.py [-p 10,100,1000] [-s 1000,100000,1000000] [-r 100,1000] [-o report.json]``
+
+The rendering of large synthetic pages is measured with the previous
+pipeline, where the WikiWords were marked by a regular expression into the
+HTML produced by docutils, and with the docutils transform. The full-text
+search is measured on synthetic wikis, and the storage of the revisions on
+pages edited a lot of times, created into a temporary SQLite database. The
+results are written as a JSON report, to be compared between releases.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import optparse
+import tempfile
+
+import docutils
+import docutils.core
+
+from sqlalchemy import select, func
+
+from nagare.namespaces import xhtml
+from nagare.examples.util.bench import timeit
+
+import wikirender
+
+wikiwords = re.compile(r'\b([A-Z]\w+[A-Z]+\w+)')
+
+
+def page(nb_paragraphs):
+    """Generate the reStructuredText of a page
+
+    Each paragraph has some WikiWords, a link and an inline literal, and is
+    followed by a literal block
+    """
+    paragraphs = []
+    for i in range(nb_paragraphs):
+        paragraphs.append(
+            u'Section%d\n%s\n\n'
+            u'A paragraph linking to FrontPage, WikiWord%d and OtherPage%d, '
+            u'with a `link <http://www.nagare.org/>`_ and a ``LiteralWord``.\n\n'
+            u'::\n\n    CodeWord%d = 42\n' % (i, u'=' * len(u'Section%d' % i), i, i, i)
+        )
+
+    return u'\n'.join(paragraphs)
+
+
+# ---------------------------------------------------------------------------
+
+def reference(h, data):
+    """The previous pipeline: the WikiWords marked into the HTML"""
+    content = docutils.core.publish_parts(data, writer_name='html')['html_body']
+    content = wikiwords.sub(r'<wiki>\1</wiki>', content)
+    html = h.parse_htmlstring(content, fragment=True)[0]
+
+    return [node.text for node in html.getiterator() if node.tag == 'wiki']
+
+
+def new(h, data):
+    """The docutils transform"""
+    html = h.parse_htmlstring(wikirender.to_html(data), fragment=True)[0]
+
+    return [node.text for node in html.getiterator() if wikirender.is_wikiword(node)]
+
+
+def bench_page(nb_paragraphs):
+    """Time the rendering of a page
+
+    Return:
+      - a dictionary
+    """
+    h = xhtml.Renderer()
+    data = page(nb_paragraphs)
+    number = 1 if nb_paragraphs > 100 else 5
+
+    return dict(
+        paragraphs=nb_paragraphs,
+        bytes=len(data.encode('utf-8')),
+        # The literals and the link texts are wrongly marked by the regular
+        # expression
+        reference_wikiwords=len(reference(h, data)),
+        new_wikiwords=len(new(h, data)),
+        reference_ms=timeit(lambda: reference(h, data), 3, number),
+        new_ms=timeit(lambda: new(h, data), 3, number)
+    )
+
+
+# ---------------------------------------------------------------------------
+
+def create_database(directory):
+    """Bind the wiki entities to a new SQLite database"""
+    import elixir
+    from sqlalchemy import create_engine
+    import wikidata
+    import wikisearch
+
+    wikidata.__metadata__.bind = create_engine('sqlite:///' + os.path.join(directory, 'wiki.db'))
+    elixir.setup_all()
+    wikidata.__metadata__.create_all()
+
+    return wikisearch.create_index(wikidata.__metadata__.bind)
+
+
+# Vocabulary of the synthetic pages: some frequent words and a lot of rare
+# ones
+FREQUENT = [u'wiki', u'page', u'nagare', u'python', u'component', u'render', u'session', u'action']
+RARE = [u'word%d' % i for i in range(10000)]
+
+
+def create_wiki(nb_pages, words=100, batch_size=1000):
+    """Insert synthetic pages, indexed by the triggers
+
+    Return:
+      - the number of pages of the wiki
+    """
+    from nagare import database
+    from wikidata import PageData
+
+    table = PageData.table
+    start = database.session.execute(select([func.count(table.c.pagename)])).scalar()
+
+    rnd = random.Random(nb_pages)
+    for i in range(start, nb_pages, batch_size):
+        rows = [
+            dict(pagename=u'Page%d' % n, data=u' '.join(rnd.choice(FREQUENT if rnd.random() < 0.2 else RARE) for j in range(words)))
+            for n in range(i, min(i + batch_size, nb_pages))
+        ]
+        with database.session.begin():
+            database.session.execute(table.insert(), rows)
+
+    return nb_pages
+
+
+def bench_search(nb_pages):
+    """Time the full-text search
+
+    Return:
+      - a dictionary
+    """
+    import wikisearch
+
+    start = time.time()
+    create_wiki(nb_pages)
+    populate = time.time() - start
+
+    return dict(
+        pages=nb_pages,
+        populate_s=populate,
+        rare_ms=timeit(lambda: wikisearch.search(u'word42'), 3, 10),
+        two_words_ms=timeit(lambda: wikisearch.search(u'nagare word42'), 3, 10),
+        frequent_ms=timeit(lambda: wikisearch.search(u'nagare'), 3, 10),
+        two_frequent_ms=timeit(lambda: wikisearch.search(u'wiki page'), 3, 10)
+    )
+
+
+def edit(rnd, data, nb_changes=3):
+    """Change, insert or remove some lines of a content"""
+    lines = data.splitlines(True)
+
+    for i in range(nb_changes):
+        n = rnd.randrange(len(lines) + 1)
+        change = rnd.random()
+
+        if (change < 0.3) and (len(lines) > 1):
+            del lines[min(n, len(lines) - 1)]
+        elif (change < 0.7) or not lines:
+            lines.insert(n, u'An inserted line, linking to Page%d\n' % rnd.randrange(1000))
+        else:
+            lines[min(n, len(lines) - 1)] = u'A changed line\n'
+
+    return u''.join(lines)
+
+
+def bench_revisions(nb_revisions):
+    """Time the rebuild of the revisions of a page edited a lot of times and
+    measure their storage
+
+    Return:
+      - a dictionary
+    """
+    from nagare import database
+    from wikidata import PageData, PageRevision, revision, SNAPSHOT_INTERVAL
+
+    rnd = random.Random(nb_revisions)
+    pagename = u'Revisions%d' % nb_revisions
+    data = page(20)
+
+    with database.session.begin():
+        PageData(pagename=pagename, data=data)
+
+    sizes = [len(data)]
+    for i in range(nb_revisions - 1):
+        data = edit(rnd, data)
+        sizes.append(len(data))
+
+        with database.session.begin():
+            PageData.get_by(pagename=pagename).data = data
+
+    database.session.expunge_all()
+
+    table = PageRevision.table
+    query = select([func.coalesce(func.sum(func.length(table.c.data)), 0)], table.c.pagename == pagename)
+    stored = database.session.execute(query).scalar()
+
+    return dict(
+        revisions=nb_revisions,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+        # Characters of all the revisions, if kept in full
+        full_chars_per_revision=float(sum(sizes)) / nb_revisions,
+        # Characters stored, the last revision being the page content
+        stored_chars_per_revision=float(stored + sizes[-1]) / nb_revisions,
+        last_revision_ms=timeit(lambda: revision(pagename, nb_revisions)),
+        # The farthest from a full revision
+        worst_revision_ms=timeit(lambda: revision(pagename, max(1, nb_revisions - nb_revisions % SNAPSHOT_INTERVAL - SNAPSHOT_INTERVAL + 1))),
+        first_revision_ms=timeit(lambda: revision(pagename, 1))
+    )
+
+
+def run(pages=(10, 100, 1000), wikis=(1000, 100000, 1000000), revisions=(100, 1000)):
+    """Run all the benchmarks
+
+    Return:
+      - the report, as a dictionary
+    """
+    report = dict(
+        python=platform.python_version(),
+        docutils=docutils.__version__,
+        pages=[bench_page(nb_paragraphs) for nb_paragraphs in pages],
+        search=[],
+        revisions=[]
+    )
+
+    directory = tempfile.mkdtemp(prefix='wiki_bench')
+    try:
+        report['fts5'] = create_database(directory)
+        for nb_pages in wikis:
+            report['search'].append(bench_search(nb_pages))
+
+        for nb_revisions in revisions:
+            report['revisions'].append(bench_revisions(nb_revisions))
+    finally:
+        shutil.rmtree(directory)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [-p 10,100,1000] [-s 1000,100000,1000000] [-r 100,1000] [-o report.json]')
+    parser.add_option('-p', '--pages', default='10,100,1000', help='numbers of paragraphs of the synthetic pages')
+    parser.add_option('-s', '--search', default='1000,100000,1000000', help='numbers of pages of the synthetic wikis')
+    parser.add_option('-r', '--revisions', default='100,1000', help='numbers of revisions of the edited pages')
+    parser.add_option('-o', '--output', help='file of the JSON report (default: standard output)')
+    (options, args) = parser.parse_args()
+
+    report = run(
+        [int(n) for n in options.pages.split(',')],
+        [int(n) for n in options.search.split(',') if n],
+        [int(n) for n in options.revisions.split(',') if n]
+    )
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
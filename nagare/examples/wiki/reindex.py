@@ -0,0 +1,55 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Creation of the full-text index of the pages
+
+Usage: ``nagare-admin batch wiki16 nagare/examples/wiki/reindex.py [-r] [-O]``
+
+The FTS5 index and its triggers are created if needed, then all the pages
+already stored are indexed. Afterwards, the pages are indexed when they are
+written. With the ``-r`` option, an existing index is rebuilt; with the
+``-O`` option, its segments are merged.
+"""
+
+import optparse
+
+from nagare.examples.wiki import wikisearch
+from nagare.examples.wiki.wikidata import PageData
+
+
+def reindex(force=False, optimize=False):
+    """Create the index of the pages
+
+    In:
+      - ``force`` -- rebuild an already existing index
+      - ``optimize`` -- merge the segments of the index
+    """
+    bind = PageData.table.bind
+
+    if not wikisearch.is_available(bind):
+        print 'No FTS5 index into this database, the pages are searched with LIKE queries'
+        return
+
+    if wikisearch.create_index(bind) or force:
+        print 'Indexing the pages'
+        wikisearch.rebuild(bind)
+
+    if optimize:
+        print 'Optimizing the index'
+        wikisearch.optimize(bind)
+
+
+# Executed when loaded by ``nagare-admin batch``, its own arguments already
+# removed from ``sys.argv``
+parser = optparse.OptionParser(usage='%prog [-r] [-O]')
+parser.add_option('-r', '--rebuild', action='store_true', default=False, help='rebuild an already existing index')
+parser.add_option('-O', '--optimize', action='store_true', default=False, help='merge the segments of the index')
+(options, args) = parser.parse_args()
+
+reindex(options.rebuild, options.optimize)
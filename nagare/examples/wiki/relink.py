@@ -0,0 +1,76 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Rebuild of the links between the pages
+
+Usage: ``nagare-admin batch wiki16 nagare/examples/wiki/relink.py [-n batch size]``
+
+The ``PageLink`` table is created if needed, emptied, then filled again from
+the WikiWords of all the pages content, by batches of pages.
+"""
+
+import optparse
+
+from sqlalchemy import select
+
+from nagare import database
+from nagare.examples.wiki import wikirender
+from nagare.examples.wiki.wikidata import PageData, PageLink
+
+BATCH_SIZE = 100
+
+
+def relink(batch_size=BATCH_SIZE):
+    """Rebuild all the links
+
+    In:
+      - ``batch_size`` -- number of pages read by query
+    """
+    pages = PageData.table
+    links = PageLink.table
+
+    links.create(checkfirst=True)
+
+    with database.session.begin():
+        database.session.execute(links.delete())
+
+        nb_pages = nb_links = 0
+        last = None
+        while True:
+            # The pages are read by batches, after the last one read
+            query = select([pages.c.pagename, pages.c.data]).order_by(pages.c.pagename).limit(batch_size)
+            if last is not None:
+                query = query.where(pages.c.pagename > last)
+
+            rows = database.session.execute(query).fetchall()
+            if not rows:
+                break
+
+            rows_links = [
+                dict(source=pagename, target=target)
+                for (pagename, data) in rows
+                for target in wikirender.links(data or u'')
+            ]
+            if rows_links:
+                database.session.execute(links.insert(), rows_links)
+
+            nb_pages += len(rows)
+            nb_links += len(rows_links)
+            last = rows[-1].pagename
+
+            print '%d pages done, %d links' % (nb_pages, nb_links)
+
+
+# Executed when loaded by ``nagare-admin batch``, its own arguments already
+# removed from ``sys.argv``
+parser = optparse.OptionParser(usage='%prog [-n batch size]')
+parser.add_option('-n', '--batch-size', type='int', default=BATCH_SIZE, help='number of pages read by query')
+(options, args) = parser.parse_args()
+
+relink(options.batch_size)
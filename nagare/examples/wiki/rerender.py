@@ -0,0 +1,67 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Rendering again of the stored pages
+
+Usage: ``nagare-admin batch wiki16 nagare/examples/wiki/rerender.py [-a]``
+
+The tables and the columns added to ``PageData`` since the database was
+created are added, then the pages never rendered, or rendered by a previous
+version of the renderer, are rendered again. With the ``-a`` option, all
+the pages are.
+"""
+
+import optparse
+
+from sqlalchemy import select
+
+from nagare import database
+from nagare.examples.wiki import wikirender
+from nagare.examples.wiki.wikidata import PageData, PageLink, PageRevision
+from nagare.examples.util.schema import add_missing_columns
+
+BATCH_SIZE = 100
+
+
+def rerender(all=False):
+    """Render the pages again
+
+    In:
+      - ``all`` -- render all the pages, not only the stale ones
+    """
+    for entity in (PageLink, PageRevision):
+        entity.table.create(checkfirst=True)
+
+    table = PageData.table
+    add_missing_columns(table)
+
+    query = select([table.c.pagename])
+    if not all:
+        query = query.where((table.c.renderer_version == None) | (table.c.renderer_version != wikirender.VERSION))  # noqa: E711
+
+    names = [row.pagename for row in database.session.execute(query)]
+    for i in range(0, len(names), BATCH_SIZE):
+        with database.session.begin():
+            for page in PageData.query.filter(PageData.pagename.in_(names[i:i + BATCH_SIZE])):
+                page.rendered_html = wikirender.to_html(page.data or u'')
+                page.renderer_version = wikirender.VERSION
+
+        # Don't keep the pages in the identity map
+        database.session.expunge_all()
+
+        print '%d/%d pages rendered' % (min(i + BATCH_SIZE, len(names)), len(names))
+
+
+# Executed when loaded by ``nagare-admin batch``, its own arguments already
+# removed from ``sys.argv``
+parser = optparse.OptionParser(usage='%prog [-a]')
+parser.add_option('-a', '--all', action='store_true', default=False, help='render all the pages, not only the stale ones')
+(options, args) = parser.parse_args()
+
+rerender(options.all)
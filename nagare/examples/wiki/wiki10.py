@@ -10,12 +10,10 @@
 """Security checks added. When not logged, editing a page or clicking on
 the 'View the complete list of pages' link raise a security exception
 """
-import re
-import docutils.core
-
 from nagare import component, presentation, var, continuation, security
 
-from wikidata import PageData
+from wikidata import PageData, backlinks, existing_pages
+import wikirender
 
 
 # ---------------------------------------------------------------------------
@@ -38,9 +36,6 @@ def render(self, h, *args):
 
 # ---------------------------------------------------------------------------
 
-wikiwords = re.compile(r'\b([A-Z]\w+[A-Z]+\w+)')
-
-
 class Page(object):
     def __init__(self, title):
         self.title = title
@@ -53,6 +48,7 @@ class Page(object):
             # to be able to modify the content of a page
             security.check_permissions('wiki.editor', self)
             page = PageData.get_by(pagename=self.title)
+            wikirender.invalidate(page.data)
             page.data = content
 
 
@@ -60,14 +56,25 @@ class Page(object):
 def render(self, h, comp, *args):
     page = PageData.get_by(pagename=self.title)
 
-    content = docutils.core.publish_parts(page.data, writer_name='html')['html_body']
-    content = wikiwords.sub(r'<wiki>\1</wiki>', content)
-    html = h.parse_htmlstring(content, fragment=True)[0]
+    # The content is rendered when saved
+    html = h.parse_htmlstring(page.html, fragment=True)[0]
+
+    h.head.css('wiki_missing', 'a.missing { color: #c00 }')
 
-    for node in html.getiterator():
-        if node.tag == 'wiki':
-            a = h.a(node.text, href='page/' + node.text).action(comp.answer, unicode(node.text))
-            node.replace(a)
+    # The WikiWords are already links, only their actions are added. The
+    # pages they link to are all looked for at once
+    wikiwords = [node for node in html.getiterator() if wikirender.is_wikiword(node)]
+    existing = existing_pages(unicode(node.text) for node in wikiwords)
+
+    for node in wikiwords:
+        title = unicode(node.text)
+        if title in existing:
+            a = h.a(node.text, href='page/' + node.text)
+        else:
+            # Clicking on the link of a missing page creates it
+            a = h.a(node.text, '?', href='page/' + node.text, class_='missing', title=u'Create the page ' + title)
+
+        node.replace(a.action(comp.answer, title))
 
     return (html, h.a('Edit this page', href='page/' + self.title).action(self.edit, comp))
 
@@ -75,7 +82,23 @@ def render(self, h, comp, *args):
 @presentation.render_for(Page, model='meta')
 def render(self, h, comp, *args):
     return ('Viewing ', h.b(self.title), h.br, h.br,
-            'You can return to the ', h.a('FrontPage', href='page/FrontPage').action(comp.answer, u'FrontPage'))
+            'You can return to the ', h.a('FrontPage', href='page/FrontPage').action(comp.answer, u'FrontPage'),
+            h.br, h.br, comp.render(h, model='backlinks'))
+
+
+@presentation.render_for(Page, model='backlinks')
+def render(self, h, comp, *args):
+    sources = backlinks(self.title)
+
+    if not sources:
+        return h.i('No page links here')
+
+    h << 'What links here:'
+    with h.ul:
+        for source in sources:
+            h << h.li(h.a(source, href='page/' + source).action(comp.answer, source))
+
+    return h.root
 
 
 # ---------------------------------------------------------------------------
@@ -14,12 +14,13 @@
 can edit it
 Then try as the administrator 'admin / admin' that can edit all the pages
 """
-import re
-import docutils.core
+import difflib
 
 from nagare import component, presentation, var, continuation, security, wsgi, log
 
-from wikidata import PageData
+from wikidata import PageData, backlinks, existing_pages, revisions, revision
+import wikirender
+import wikisearch
 
 
 # ---------------------------------------------------------------------------
@@ -50,12 +51,15 @@ def render(self, h, binding, *args):
 
 # ---------------------------------------------------------------------------
 
-wikiwords = re.compile(r'\b([A-Z]\w+[A-Z]+\w+)')
-
-
 class Page(object):
     def __init__(self, title):
         self.title = title
+        # The revision displayed by the ``diff`` view
+        self.revision = None
+
+    def show_revision(self, comp, number):
+        self.revision = number
+        comp.becomes(self, model='diff')
 
     def edit(self, comp):
         content = comp.call(PageEditor(self))
@@ -64,6 +68,7 @@ class Page(object):
             log.info('New content for page [%s]: [%s...]' % (self.title, content[:50]))
             security.check_permissions('wiki.editor', self)
             page = PageData.get_by(pagename=self.title)
+            wikirender.invalidate(page.data)
             page.data = content
 
             # If the creator of the page is not already set, set it with the
@@ -77,19 +82,32 @@ class Page(object):
 def render(self, h, comp, *args):
     page = PageData.get_by(pagename=self.title)
 
-    content = docutils.core.publish_parts(page.data, writer_name='html')['html_body']
-    content = wikiwords.sub(r'<wiki>\1</wiki>', content)
-    html = h.parse_htmlstring(content, fragment=True)[0]
+    # The content is rendered when saved
+    html = h.parse_htmlstring(page.html, fragment=True)[0]
+
+    h.head.css('wiki_missing', 'a.missing { color: #c00 }')
 
-    for node in html.getiterator():
-        if node.tag == 'wiki':
-            a = h.a(node.text, href='page/' + node.text).action(comp.answer, unicode(node.text))
-            node.replace(a)
+    # The WikiWords are already links, only their actions are added. The
+    # pages they link to are all looked for at once
+    wikiwords = [node for node in html.getiterator() if wikirender.is_wikiword(node)]
+    existing = existing_pages(unicode(node.text) for node in wikiwords)
+
+    for node in wikiwords:
+        title = unicode(node.text)
+        if title in existing:
+            a = h.a(node.text, href='page/' + node.text)
+        else:
+            # Clicking on the link of a missing page creates it
+            a = h.a(node.text, '?', href='page/' + node.text, class_='missing', title=u'Create the page ' + title)
+
+        node.replace(a.action(comp.answer, title))
 
     h << html
 
     if security.has_permissions('wiki.editor', self):
-        h << h.a('Edit this page', href='page/' + self.title).action(self.edit, comp)
+        h << h.a('Edit this page', href='page/' + self.title).action(self.edit, comp) << ' '
+
+    h << h.a('History').action(lambda: comp.becomes(self, model='history'))
 
     return h.root
 
@@ -104,6 +122,71 @@ def render(self, h, comp, *args):
         h << h.i('Created by ', page.creator) << h.br
 
     h << 'You can return to the ' << h.a('FrontPage', href='page/FrontPage')
+    h << h.br << h.br << comp.render(h, model='backlinks')
+
+    return h.root
+
+
+@presentation.render_for(Page, model='backlinks')
+def render(self, h, comp, *args):
+    sources = backlinks(self.title)
+
+    if not sources:
+        return h.i('No page links here')
+
+    h << 'What links here:'
+    with h.ul:
+        for source in sources:
+            h << h.li(h.a(source, href='page/' + source).action(comp.answer, source))
+
+    return h.root
+
+
+# The revisions of the page, the last one first
+@presentation.render_for(Page, model='history')
+def render(self, h, comp, *args):
+    with h.table:
+        h << h.tr(h.th('Revision'), h.th('Date'), h.th('Stored'))
+
+        for (number, date, kind, size) in revisions(self.title):
+            with h.tr:
+                h << h.td(h.a(number).action(self.show_revision, comp, number))
+                h << h.td(date.strftime('%Y-%m-%d %H:%M') if date else '')
+                h << h.td('current content' if kind == u'last' else '%s, %d characters' % (kind, size))
+
+    h << h.a('Back to the page').action(lambda: comp.becomes(self, model=None))
+
+    return h.root
+
+
+# The changes of a revision, compared to the previous one
+@presentation.render_for(Page, model='diff')
+def render(self, h, comp, *args):
+    h.head.css('wiki_diff', '.diff .added { color: green } .diff .removed { color: #c00 }')
+
+    new = revision(self.title, self.revision) or u''
+    old = revision(self.title, self.revision - 1) or u''
+
+    with h.pre(class_='diff'):
+        diff = difflib.unified_diff(
+            old.splitlines(), new.splitlines(),
+            'revision %d' % (self.revision - 1), 'revision %d' % self.revision,
+            lineterm=''
+        )
+
+        for line in diff:
+            if line.startswith(('+++', '---')):
+                h << h.b(line)
+            elif line.startswith('+'):
+                h << h.span(line, class_='added')
+            elif line.startswith('-'):
+                h << h.span(line, class_='removed')
+            else:
+                h << line
+
+            h << '\n'
+
+    h << h.a('Back to the history').action(lambda: comp.becomes(self, model='history'))
 
     return h.root
 
@@ -140,6 +223,36 @@ def render(self, h, *args):
     return ('Editing ', h.b(self.page.title))
 
 
+# ---------------------------------------------------------------------------
+
+class Search(object):
+    def __init__(self, query):
+        self.query = query
+
+
+@presentation.render_for(Search)
+def render(self, h, comp, *args):
+    results = wikisearch.search(self.query)
+
+    if not results:
+        return h.i('No page found')
+
+    with h.ul:
+        for (pagename, snippet) in results:
+            with h.li:
+                h << h.a(pagename, href='page/' + pagename).action(comp.answer, pagename)
+
+                if snippet:
+                    h << h.br << [h.b(text) if matched else text for (text, matched) in snippet]
+
+    return h.root
+
+
+@presentation.render_for(Search, model='meta')
+def render(self, h, *args):
+    return ('Searching ', h.b(self.query))
+
+
 # ---------------------------------------------------------------------------
 
 class Wiki(object):
@@ -162,6 +275,9 @@ class Wiki(object):
         new_page = comp.call(model='all')
         self.goto(new_page)
 
+    def search(self, query):
+        self.content.becomes(Search(query()))
+
 
 @presentation.render_for(Wiki)
 def render(self, h, comp, *args):
@@ -174,6 +290,11 @@ def render(self, h, comp, *args):
     with h.div(class_='login'):
         h << self.login
 
+    query = var.Var(u'')
+    with h.form:
+        h << h.input().action(query) << ' '
+        h << h.input(type='submit', value='Search').action(self.search, query)
+
     with h.div(class_='meta'):
         h << self.content.render(h, model='meta')
 
@@ -209,6 +330,11 @@ def init(self, url, *args):
     self.goto(title)
 
 
+@presentation.init_for(Wiki, "(len(url) == 2) and (url[0] == 'search')")
+def init(self, url, *args):
+    self.search(var.Var(url[1]))
+
+
 @presentation.init_for(Wiki, "len(url) and (url[0] == 'all')")
 def init(self, url, comp, *args):
     continuation.Continuation(self.select_a_page, comp)
@@ -291,5 +417,15 @@ class WSGIApp(wsgi.WSGIApp):
         super(WSGIApp, self).__init__(app_factory)
         self.security = SecurityManager()
 
+    def set_config(self, config_filename, config, error):
+        super(WSGIApp, self).set_config(config_filename, config, error)
+
+        # Optional ``[wiki]`` section of the application configuration
+        conf = config.get('wiki', {})
+        wikirender.cache.configure(
+            int(conf.get('cache_size', wikirender.cache.max_bytes)),
+            conf.get('cache_directory') or None
+        )
+
 
 app = WSGIApp(lambda: component.Component(Wiki()))
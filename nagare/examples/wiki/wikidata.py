@@ -7,8 +7,19 @@
 # this distribution.
 # --
 
-from elixir import Entity, Field, Unicode
-from sqlalchemy import MetaData
+import json
+import difflib
+import datetime
+
+from elixir import Entity, Field, Unicode, UnicodeText, Integer, DateTime
+from elixir.events import before_insert, before_update, after_insert, after_update, after_delete
+from sqlalchemy import MetaData, select, func
+from sqlalchemy.orm.attributes import get_history
+
+from nagare import database
+
+import wikirender
+import wikisearch
 
 __metadata__ = MetaData()
 
@@ -17,11 +28,275 @@ class PageData(Entity):
     pagename = Field(Unicode(40), primary_key=True)
     data = Field(Unicode(10 * 1024))
     creator = Field(Unicode(40))
+    # The content rendered when saved, and the version of the renderer used
+    rendered_html = Field(UnicodeText)
+    renderer_version = Field(Integer)
+
+    @before_insert
+    @before_update
+    def render(self):
+        """Render the content when saved, if changed or rendered by a
+        previous version of the renderer
+        """
+        if get_history(self, 'data').has_changes() or (self.renderer_version != wikirender.VERSION):
+            (self.rendered_html, self.wikiwords) = wikirender.publish(self.data or u'')
+            self.renderer_version = wikirender.VERSION
+
+    @before_insert
+    @before_update
+    def revise(self):
+        """Keep the previous content, when changed"""
+        history = get_history(self, 'data')
+        if history.has_changes():
+            if history.deleted:
+                self.previous = history.deleted[0]
+            else:
+                # Not loaded
+                table = self.table
+                self.previous = database.session.execute(select([table.c.data], table.c.pagename == self.pagename)).scalar()
+
+    @after_insert
+    @after_update
+    def save_links(self):
+        """Update the links from the page, when its content was rendered"""
+        wikiwords = self.__dict__.pop('wikiwords', None)
+        if wikiwords is not None:
+            update_links(self.pagename, wikiwords)
+
+    @after_insert
+    @after_update
+    def save_revision(self):
+        """Add a revision, when the content changed"""
+        if 'previous' in self.__dict__:
+            add_revision(self.pagename, self.__dict__.pop('previous'), self.data or u'')
+
+    @after_delete
+    def delete_links(self):
+        update_links(self.pagename, ())
+
+    @property
+    def html(self):
+        """The rendered content
+
+        Rendered on the fly, or got from the cache, if not rendered by the
+        current version of the renderer
+        """
+        if (self.rendered_html is None) or (self.renderer_version != wikirender.VERSION):
+            return wikirender.render(self.data)
+
+        return self.rendered_html
+
+
+class PageLink(Entity):
+    """A WikiWord of a page content, linking to a page that may not exist"""
+    source = Field(Unicode(40), primary_key=True)
+    target = Field(Unicode(40), primary_key=True, index=True)
+
+
+def update_links(source, targets):
+    """Replace the links from a page
+
+    Only the links added or removed are written
+
+    In:
+      - ``source`` -- name of the page
+      - ``targets`` -- the WikiWords of its content
+    """
+    table = PageLink.table
+    targets = set(targets)
+
+    query = select([table.c.target], table.c.source == source)
+    existing = set(target for (target,) in database.session.execute(query))
+
+    removed = existing - targets
+    if removed:
+        database.session.execute(table.delete((table.c.source == source) & table.c.target.in_(removed)))
+
+    added = targets - existing
+    if added:
+        database.session.execute(table.insert(), [dict(source=source, target=target) for target in added])
+
+
+def backlinks(target):
+    """Return the names of the pages linking to a page, in order"""
+    table = PageLink.table
+    query = select([table.c.source], table.c.target == target).order_by(table.c.source)
+
+    return [source for (source,) in database.session.execute(query)]
+
+
+# ---------------------------------------------------------------------------
+
+# Every revision multiple of this interval is kept in full, so that any
+# revision is rebuilt with less than ``SNAPSHOT_INTERVAL`` deltas
+SNAPSHOT_INTERVAL = 20
+
+
+class PageRevision(Entity):
+    """A revision of a page content
+
+    The last revision is the content of the page, not stored here. The
+    previous ones are kept as the difference with the next revision, or in
+    full every ``SNAPSHOT_INTERVAL`` revisions
+    """
+    pagename = Field(Unicode(40), primary_key=True)
+    number = Field(Integer, primary_key=True, autoincrement=False)
+    # u'last', u'delta' or u'full'
+    kind = Field(Unicode(5))
+    data = Field(UnicodeText)
+    date = Field(DateTime, default=datetime.datetime.now)
+
+
+def delta(new, old):
+    """Difference between two contents
+
+    In:
+      - ``new`` -- content of a revision
+      - ``old`` -- content of the previous revision
+
+    Return:
+      - the opcodes to rebuild ``old`` from ``new``, as JSON. A copy of the
+        lines of ``new`` is a ``[start, end]`` list, a replacement the list of
+        the lines of ``old``, as strings
+    """
+    new = new.splitlines(True)
+    old = old.splitlines(True)
+
+    opcodes = []
+    for (tag, i1, i2, j1, j2) in difflib.SequenceMatcher(None, new, old, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            opcodes.append([i1, i2])
+        elif j1 != j2:
+            opcodes.append(old[j1:j2])
+
+    return unicode(json.dumps(opcodes, ensure_ascii=False, separators=(',', ':')))
+
+
+def patch(new, delta):
+    """Rebuild the content of a revision from the content of the next one
+
+    In:
+      - ``new`` -- content of the next revision
+      - ``delta`` -- the ``delta()`` between them
+
+    Return:
+      - the content of the revision
+    """
+    new = new.splitlines(True)
+
+    lines = []
+    for opcode in json.loads(delta):
+        if opcode and isinstance(opcode[0], int):
+            lines.extend(new[opcode[0]:opcode[1]])
+        else:
+            lines.extend(opcode)
+
+    return u''.join(lines)
+
+
+def add_revision(pagename, old, new):
+    """Add the new content of a page as its last revision
+
+    The previous last revision is replaced by its difference with the new
+    content, or by its full content
+
+    In:
+      - ``pagename`` -- name of the page
+      - ``old`` -- the previous content of the page, ``None`` for a new page
+      - ``new`` -- its new content
+    """
+    table = PageRevision.table
+    last = database.session.execute(select([func.max(table.c.number)], table.c.pagename == pagename)).scalar()
+
+    if last is None:
+        if old is not None:
+            # History of a page created before the revisions were kept
+            last = 1
+            database.session.execute(table.insert(), dict(pagename=pagename, number=last, kind=u'full', data=old))
+    else:
+        kind = u'full' if (last % SNAPSHOT_INTERVAL) == 0 else u'delta'
+        data = (old or u'') if kind == u'full' else delta(new, old or u'')
+
+        where = (table.c.pagename == pagename) & (table.c.number == last)
+        database.session.execute(table.update(where, dict(kind=kind, data=data)))
+
+    database.session.execute(table.insert(), dict(pagename=pagename, number=(last or 0) + 1, kind=u'last'))
+
+
+def revisions(pagename):
+    """Return the revisions of a page, the last one first
+
+    Return:
+      - list of tuples (number, date, kind, size stored)
+    """
+    table = PageRevision.table
+    query = select(
+        [table.c.number, table.c.date, table.c.kind, func.coalesce(func.length(table.c.data), 0)],
+        table.c.pagename == pagename
+    ).order_by(table.c.number.desc())
+
+    return database.session.execute(query).fetchall()
+
+
+def revision(pagename, number):
+    """Rebuild the content of a revision
+
+    In:
+      - ``pagename`` -- name of the page
+      - ``number`` -- number of the revision
+
+    Return:
+      - the content, ``None`` if the revision doesn't exist
+    """
+    table = PageRevision.table
+
+    # The revisions up to the next one kept in full
+    query = select([table.c.number, table.c.kind, table.c.data], (table.c.pagename == pagename) & (table.c.number >= number))
+    query = query.order_by(table.c.number).limit(SNAPSHOT_INTERVAL + 1)
+
+    deltas = []
+    for (n, kind, data) in database.session.execute(query).fetchall():
+        if not deltas and (n != number):
+            # Unknown revision
+            return None
+
+        if kind == u'delta':
+            deltas.append(data)
+            continue
+
+        if kind == u'last':
+            data = database.session.execute(select([PageData.table.c.data], PageData.table.c.pagename == pagename)).scalar() or u''
+
+        for d in reversed(deltas):
+            data = patch(data, d)
+
+        return data
+
+    return None
+
+
+# ---------------------------------------------------------------------------
+
+def existing_pages(names):
+    """Return the names of the pages that exist among ``names``, with only
+    one query
+    """
+    names = set(names)
+    if not names:
+        return set()
+
+    table = PageData.table
+    query = select([table.c.pagename], table.c.pagename.in_(names))
+
+    return set(name for (name,) in database.session.execute(query))
 
 
 # ---------------------------------------------------------------------------
 
 def populate():
+    # Created first, so that the pages are indexed
+    wikisearch.create_index(PageData.table.bind)
+
     page = PageData()
     page.pagename = u'FrontPage'
     page.data = u'Welcome to my *WikiWiki* !'
@@ -0,0 +1,231 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Rendering of the pages content, with a cache of the HTML fragments
+
+The reStructuredText of a page is rendered by docutils, its WikiWords turned
+into links by a docutils transform. The result only depends on the content, so
+it is cached, keyed by the hash of the content: in memory, bounded by the
+total size of the fragments, and optionally into a directory where it
+survives the restarts.
+"""
+
+import os
+import re
+import hashlib
+
+import docutils.core
+from docutils import nodes
+from docutils.readers import standalone
+from docutils.transforms import Transform
+
+from nagare.examples.util import lrucache, files
+
+# Version of the rendering, to increase when it changes. The pages rendered
+# by a previous version are rendered again
+VERSION = 2
+
+wikiwords = re.compile(r'\b([A-Z]\w+[A-Z]+\w+)')
+
+# The WikiWords into these nodes are not links
+NOT_LINKED = (nodes.reference, nodes.literal, nodes.FixedTextElement, nodes.raw, nodes.comment, nodes.target)
+
+
+class WikiWords(Transform):
+    """Turn the WikiWords of the document into references to the pages
+
+    The references are rendered as ``<a class="wiki" href="page/...">`` links
+    """
+    default_priority = 800
+
+    def apply(self):
+        for node in list(self.document.traverse(nodes.Text)):
+            parent = node.parent
+            while (parent is not None) and not isinstance(parent, NOT_LINKED):
+                parent = parent.parent
+
+            if parent is not None:
+                continue
+
+            text = node.astext()
+
+            children = []
+            start = 0
+            for match in wikiwords.finditer(text):
+                if match.start() > start:
+                    children.append(nodes.Text(text[start:match.start()]))
+
+                word = match.group(1)
+                children.append(nodes.reference(word, word, refuri='page/' + word, classes=['wiki']))
+
+                start = match.end()
+
+            if children:
+                if start < len(text):
+                    children.append(nodes.Text(text[start:]))
+
+                node.parent.replace(node, children)
+
+
+class Reader(standalone.Reader):
+    """The standalone reader, with the ``WikiWords`` transform"""
+    def get_transforms(self):
+        return standalone.Reader.get_transforms(self) + [WikiWords]
+
+
+def wikiwords_of(document):
+    """Return the set of the WikiWords linked from a document"""
+    return set(node.astext() for node in document.traverse(nodes.reference) if 'wiki' in node['classes'])
+
+
+def publish(data):
+    """Render a page content
+
+    The WikiWords are turned into links while the document is built, except
+    into the literal blocks and the existing links
+
+    In:
+      - ``data`` -- the reStructuredText of the page
+
+    Return:
+      - a tuple (HTML fragment, with the WikiWords as ``<a class="wiki">``
+        links, set of the WikiWords)
+    """
+    reader = Reader()
+    html = docutils.core.publish_parts(data, reader=reader, writer_name='html')['html_body']
+
+    return html, wikiwords_of(reader.document)
+
+
+def to_html(data):
+    """Render a page content
+
+    In:
+      - ``data`` -- the reStructuredText of the page
+
+    Return:
+      - the HTML fragment, with the WikiWords as ``<a class="wiki">`` links
+    """
+    return publish(data)[0]
+
+
+def links(data):
+    """Return the set of the WikiWords of a page content, without rendering it"""
+    return wikiwords_of(docutils.core.publish_doctree(data, reader=Reader()))
+
+
+def is_wikiword(node):
+    """Is a node of a parsed fragment a WikiWord link?"""
+    return (node.tag == 'a') and ('wiki' in (node.get('class') or '').split())
+
+
+class FragmentCache(lrucache.LRUCache):
+    """The LRU cache of the fragments, also written into a directory"""
+    def __init__(self, max_bytes=16 * 1024 * 1024, directory=None):
+        """Initialization
+
+        In:
+          - ``max_bytes`` -- maximum total size of the fragments kept in memory
+          - ``directory`` -- where the fragments are also written, if any
+        """
+        self.disk_hits = 0
+        super(FragmentCache, self).__init__(max_bytes)
+        self.configure(max_bytes, directory)
+
+    def configure(self, max_bytes, directory=None):
+        # A fragment is kept whatever its size, up to the total size
+        super(FragmentCache, self).configure(max_bytes, max_bytes)
+        self.directory = directory and os.path.abspath(directory)
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha256(('%d:' % VERSION) + data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        """Return a fragment, as UTF-8, or ``None``"""
+        fragment = super(FragmentCache, self).get(key)
+        if (fragment is None) and (self.directory is not None):
+            try:
+                with open(self.path(key), 'rb') as f:
+                    fragment = f.read()
+            except IOError:
+                pass
+            else:
+                self.put(key, fragment, False)
+                with self.lock:
+                    self.disk_hits += 1
+
+        return fragment
+
+    def put(self, key, fragment, write=True):
+        """Keep a fragment
+
+        In:
+          - ``key`` -- hash of the page content
+          - ``fragment`` -- the HTML fragment, as UTF-8
+          - ``write`` -- also write the fragment into the directory?
+        """
+        super(FragmentCache, self).put(key, fragment, len(fragment))
+
+        if write and (self.directory is not None):
+            files.create_file(self.path(key), [fragment])
+
+    def invalidate(self, key):
+        """Remove a fragment from the memory and the directory"""
+        self.discard(key)
+
+        if self.directory is not None:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Metrics of the cache, with the ``disk_hits`` counter of the
+        fragments read from the directory after a miss in memory
+        """
+        stats = super(FragmentCache, self).stats()
+        with self.lock:
+            stats['disk_hits'] = self.disk_hits
+
+        return stats
+
+    def render(self, data):
+        """Render a page content, or get it from the cache
+
+        In:
+          - ``data`` -- the reStructuredText of the page
+
+        Return:
+          - the HTML fragment, with the WikiWords as ``<a class="wiki">`` links
+        """
+        key = self.key(data)
+
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = to_html(data).encode('utf-8')
+            self.put(key, fragment)
+
+        return fragment.decode('utf-8')
+
+
+# The cache shared by all the sessions
+cache = FragmentCache()
+
+
+def render(data):
+    return cache.render(data or u'')
+
+
+def invalidate(data):
+    """Remove the rendering of a page content from the cache"""
+    cache.invalidate(cache.key(data or u''))
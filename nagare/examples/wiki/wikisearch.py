@@ -0,0 +1,228 @@
+# --
+# Copyright (c) 2008-2017 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Full-text search of the pages, with a SQLite FTS5 index
+
+The index is an external content FTS5 table: only the index is stored, the
+names and contents of the pages are read from the ``PageData`` table. It is
+kept in sync by triggers, so each write of a page is indexed in the same
+transaction. As the index refers to the ``rowid`` of the pages, it must be
+rebuilt after a ``VACUUM``.
+
+The BM25 ranking reads all the occurrences of each word searched, which is
+too long for the words found in a lot of pages. So only the words found in at
+most ``MAX_RANKED`` pages are ranked, the others only filter the results. When
+all the words are that frequent, the most recently created pages come first.
+The snippets are only built for the results returned.
+
+With another database, or a SQLite without FTS5, the pages are searched with
+``LIKE`` queries, without ranking nor snippets.
+"""
+
+import re
+
+from sqlalchemy import select, and_
+
+from nagare import database
+
+import wikidata
+
+# Markers of the matched terms into the snippets
+START = u'\x02'
+END = u'\x03'
+
+# Number of words of the snippets
+SNIPPET_SIZE = 16
+
+# Maximum number of pages of a word to rank
+MAX_RANKED = 10000
+
+DDL = (
+    "CREATE VIRTUAL TABLE %(index)s USING fts5(pagename, data, content='%(table)s', content_rowid='rowid')",
+
+    "CREATE TRIGGER %(index)s_insert AFTER INSERT ON %(table)s BEGIN "
+    "INSERT INTO %(index)s(rowid, pagename, data) VALUES (new.rowid, new.pagename, new.data); "
+    "END",
+
+    "CREATE TRIGGER %(index)s_delete AFTER DELETE ON %(table)s BEGIN "
+    "INSERT INTO %(index)s(%(index)s, rowid, pagename, data) VALUES ('delete', old.rowid, old.pagename, old.data); "
+    "END",
+
+    # Not fired when only the rendering of a page is stored
+    "CREATE TRIGGER %(index)s_update AFTER UPDATE OF pagename, data ON %(table)s BEGIN "
+    "INSERT INTO %(index)s(%(index)s, rowid, pagename, data) VALUES ('delete', old.rowid, old.pagename, old.data); "
+    "INSERT INTO %(index)s(rowid, pagename, data) VALUES (new.rowid, new.pagename, new.data); "
+    "END"
+)
+
+# Number of pages of a word, counted up to a limit
+COUNT = "SELECT count(*) FROM (SELECT 1 FROM %(index)s WHERE %(index)s MATCH :query LIMIT :limit)"
+
+# All the rowids when ``limit`` is negative
+RANKED = "SELECT rowid FROM %(index)s WHERE %(index)s MATCH :query ORDER BY rank LIMIT :limit"
+
+MATCHING = "SELECT rowid FROM %(index)s WHERE %(index)s MATCH :query"
+
+RECENT = (
+    "SELECT rowid, pagename, snippet(%(index)s, -1, :start, :end, '...', :size) FROM %(index)s "
+    "WHERE %(index)s MATCH :query ORDER BY rowid DESC LIMIT :limit"
+)
+
+# The rowids are directly inserted, as integers
+SNIPPETS = (
+    "SELECT rowid, pagename, snippet(%(index)s, -1, :start, :end, '...', :size) FROM %(index)s "
+    "WHERE %(index)s MATCH :query AND rowid IN (%(rowids)s)"
+)
+
+
+def names():
+    table = wikidata.PageData.table
+    return dict(table=table.name, index=table.name + '_search')
+
+
+def is_available(bind):
+    """Can the pages be indexed into this database?"""
+    if bind.dialect.name != 'sqlite':
+        return False
+
+    return bool(bind.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def has_index(bind):
+    """Is the index of the pages created into this database?"""
+    if bind.dialect.name != 'sqlite':
+        return False
+
+    query = "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = :name"
+    return bool(bind.execute(query, name=names()['index']).scalar())
+
+
+def create_index(bind):
+    """Create the index and its triggers, if not already created
+
+    The pages already stored are not indexed, see ``rebuild()``
+
+    In:
+      - ``bind`` -- the engine of the pages
+
+    Return:
+      - ``True`` if the index was created
+    """
+    if not is_available(bind) or has_index(bind):
+        return False
+
+    for statement in DDL:
+        bind.execute(statement % names())
+
+    return True
+
+
+def rebuild(bind):
+    """Index again all the pages"""
+    bind.execute("INSERT INTO %(index)s(%(index)s) VALUES ('rebuild')" % names())
+
+
+def optimize(bind):
+    """Merge all the segments of the index, after a lot of pages were indexed"""
+    bind.execute("INSERT INTO %(index)s(%(index)s) VALUES ('optimize')" % names())
+
+
+def match_expression(query):
+    """Turn the words typed into a FTS5 query
+
+    Each word is quoted, so that the FTS5 syntax is not interpreted. They are
+    not used as prefixes, as a short prefix can match most of the index
+    """
+    return u' '.join(u'"%s"' % word.replace(u'"', u'""') for word in query.split())
+
+
+def highlights(snippet):
+    """Split a snippet
+
+    Return:
+      - list of tuples (text, is it a matched term?)
+    """
+    return [(text, bool(i % 2)) for (i, text) in enumerate(re.split(u'[%s%s]' % (START, END), snippet)) if text]
+
+
+def execute(statement, **params):
+    """Execute a statement of the index, with the names of ``names()``"""
+    return database.session.execute(statement % names(), params, mapper=wikidata.PageData).fetchall()
+
+
+def search_index(words, limit):
+    """Search the pages into the index
+
+    In:
+      - ``words`` -- the words to search
+      - ``limit`` -- maximum number of results
+
+    Return:
+      - list of tuples (page name, snippet)
+    """
+    query = match_expression(u' '.join(words))
+    snippets = dict(query=query, start=START, end=END, size=SNIPPET_SIZE)
+
+    # The occurrences of a word are counted up to ``MAX_RANKED``
+    ranked = [
+        word for word in words
+        if execute(COUNT, query=match_expression(word), limit=MAX_RANKED + 1)[0][0] <= MAX_RANKED
+    ]
+
+    if not ranked:
+        rows = execute(RECENT, limit=limit, **snippets)
+    else:
+        filtered = len(ranked) != len(words)
+        rowids = execute(RANKED, query=match_expression(u' '.join(ranked)), limit=-1 if filtered else limit)
+        rowids = [rowid for (rowid,) in rowids]
+
+        if filtered:
+            # The frequent words only filter the ranked pages
+            matching = set(rowid for (rowid,) in execute(MATCHING, query=query))
+            rowids = [rowid for rowid in rowids if rowid in matching]
+
+        rowids = rowids[:limit]
+        if not rowids:
+            return []
+
+        rows = execute(SNIPPETS % dict(names(), rowids=','.join(str(int(rowid)) for rowid in rowids)), **snippets)
+        order = dict((rowid, i) for (i, rowid) in enumerate(rowids))
+        rows = sorted(rows, key=lambda row: order[row[0]])
+
+    return [(pagename, highlights(snippet or u'')) for (rowid, pagename, snippet) in rows]
+
+
+def search(query, limit=20):
+    """Search the pages
+
+    In:
+      - ``query`` -- the words to search
+      - ``limit`` -- maximum number of results
+
+    Return:
+      - list of tuples (page name, snippet), the best matches first. The
+        snippet is a ``highlights()`` list, empty without the index
+    """
+    words = query.split()
+    if not words:
+        return []
+
+    table = wikidata.PageData.table
+
+    if has_index(table.bind):
+        return search_index(words, limit)
+
+    # The wildcards typed are searched literally
+    criteria = [
+        table.c.data.like(u'%' + re.sub(r'([\\%_])', r'\\\1', word) + u'%', escape='\\')
+        for word in words
+    ]
+    query = select([table.c.pagename], and_(*criteria)).order_by(table.c.pagename).limit(limit)
+
+    return [(pagename, []) for (pagename,) in database.session.execute(query)]
@@ -35,7 +35,7 @@ setup(
     [nagare.applications]
     demo = nagare.examples.demo:app
     wiki = nagare.examples.wiki.wiki9:app
-    gallery = nagare.examples.gallery.gallery7:app
+    gallery = nagare.examples.gallery.gallery7:wsgi_app
     portal = nagare.examples.portal.portal:app
     jewels = nagare.examples.jewels:app
     chat = nagare.examples.chat:app